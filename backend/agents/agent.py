@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import AsyncGenerator, List, Optional, Dict
+from typing import AsyncGenerator, Callable, List, Optional, Dict, Tuple
 import re
 import json
 import asyncio
@@ -7,13 +7,25 @@ import asyncio
 from db.models import Project, Stack, User, UserType
 from sandbox.sandbox import DevSandbox
 from sandbox.browser import BrowserMonitor
+from sandbox.lint import ESLINT_CONFIG_PATH
+from sandbox.dev_logs import is_watched_source
 from agents.third_party_docs import DOCS
 from agents.prompts import (
     chat_complete,
+    needs_planning,
+)
+from config import (
+    MAIN_MODEL,
+    MAIN_PROVIDER,
+    PLANNING_MODE,
+    CONTEXT_FOLLOW_UP_MAX_TOKENS,
+    SHELL_TOOL_TIMEOUT_SECONDS,
+    SHELL_TOOL_MAX_OUTPUT_CHARS,
+    DEV_SERVER_COMPILE_WAIT_SECONDS,
 )
-from config import MAIN_MODEL, MAIN_PROVIDER
 from agents.diff import remove_file_changes, AsyncArtifactDiffApplier
-from agents.providers import AgentTool, LLM_PROVIDERS
+from agents.context import build_context
+from agents.providers import AgentTool, get_llm_provider
 
 
 USER_TYPE_STYLES: Dict[UserType, str] = {
@@ -39,6 +51,7 @@ class ChatMessage(BaseModel):
     role: str
     content: str
     images: Optional[List[str]] = None
+    summary: Optional[str] = None
 
 
 class PartialChatMessage(BaseModel):
@@ -48,15 +61,49 @@ class PartialChatMessage(BaseModel):
     persist: bool = True
 
 
-def build_run_command_tool(sandbox: Optional[DevSandbox] = None):
+def _truncate_middle(text: str, max_chars: int) -> str:
+    """Keep the head and tail of long output, noting what was dropped in between."""
+    if len(text) <= max_chars:
+        return text
+    head = text[: max_chars // 2]
+    tail = text[len(text) - max_chars // 2 :]
+    omitted = text[len(head) : len(text) - len(tail)]
+    return f"{head}\n\n... [{len(omitted)} characters, {omitted.count(NL)} lines omitted] ...\n\n{tail}"
+
+
+def build_run_command_tool(
+    sandbox: Optional[DevSandbox] = None,
+    on_output: Optional[Callable[[str], None]] = None,
+):
     async def func(command: str, workdir: Optional[str] = None) -> str:
         if sandbox is None:
             return "This environment is still booting up! Try again in a minute."
-        result = await sandbox.run_command(command, workdir=workdir)
+
+        # Stream output to the UI, capped at the same budget the model gets
+        streamed = {"chars": 0}
+
+        def _on_output(text: str):
+            if on_output is None or streamed["chars"] > SHELL_TOOL_MAX_OUTPUT_CHARS:
+                return
+            if streamed["chars"] == 0:
+                on_output("```output\n")
+            streamed["chars"] += len(text)
+            if streamed["chars"] > SHELL_TOOL_MAX_OUTPUT_CHARS:
+                text += "\n... (output truncated)"
+            on_output(text)
+
+        result = await sandbox.run_command(
+            command,
+            workdir=workdir,
+            timeout=SHELL_TOOL_TIMEOUT_SECONDS,
+            on_output=_on_output,
+        )
+        if streamed["chars"] > 0:
+            on_output("\n```\n\n")
         print(f"$ {command} -> {result[:20]}")
         if result == "":
             result = "<empty response>"
-        return result
+        return _truncate_middle(result, SHELL_TOOL_MAX_OUTPUT_CHARS)
 
     return AgentTool(
         name="run_shell_cmd",
@@ -76,6 +123,8 @@ def build_run_command_tool(sandbox: Optional[DevSandbox] = None):
             "required": ["command"],
         },
         func=func,
+        # Streamed output of overlapping commands would interleave in the chat
+        serial=on_output is not None,
     )
 
 
@@ -143,27 +192,32 @@ def build_apply_changes_tool(
             return "Sandbox is not yet ready. Stop and try again after a minute."
 
         agent.working_page = navigate_to
+        compile_seq = agent.sandbox.logs.event_seq
 
         # Run these tasks in parallel with gather
         processed_files, has_lint_file = await asyncio.gather(
-            diff_applier.apply(), agent.sandbox.has_file("/app/frontend/.eslintrc.json")
+            diff_applier.apply(), agent.sandbox.has_file(ESLINT_CONFIG_PATH)
         )
 
         # Prepare the lint check task
         async def run_lint_check():
             if not has_lint_file:
                 return "No lint configuration found"
-            lint_output = await agent.sandbox.run_command(
-                "npm run lint", workdir="/app/frontend"
-            )
-            return (
-                "Error: " + lint_output
-                if "Error:" in lint_output
-                else "Lint successful!"
-            )
+            # Applying already linted the files unless it couldn't do so per file
+            lint = diff_applier.last_lint or await agent.sandbox.lint(processed_files)
+            print(f"Lint ({lint.mode}) has_errors={lint.has_errors}")
+            return "Error: " + lint.output if lint.has_errors else "Lint successful!"
+
+        browser_done = asyncio.Event()
 
         # Prepare the browser check task
         async def run_browser_check():
+            try:
+                return await check_browser()
+            finally:
+                browser_done.set()
+
+        async def check_browser():
             if not agent.app_temp_url:
                 return (
                     "Browser check skipped - no preview URL available or screenshot disabled",
@@ -194,10 +248,49 @@ def build_apply_changes_tool(
                     }
             return browser_result, browser_screenshot
 
-        # Run lint and browser checks in parallel
-        lint_result, (browser_result, browser_screenshot) = await asyncio.gather(
-            run_lint_check(), run_browser_check()
+        # Watch the dev server's output for the rebuild of the changes
+        async def run_dev_server_check() -> Optional[str]:
+            if not any(is_watched_source(path) for path in processed_files):
+                return None
+            # Once the page has loaded the rebuild it needed is done, stop waiting then
+            compile_task = asyncio.create_task(
+                agent.sandbox.logs.wait_for_compile(
+                    compile_seq, timeout=DEV_SERVER_COMPILE_WAIT_SECONDS
+                )
+            )
+            browser_done_task = asyncio.create_task(browser_done.wait())
+            try:
+                await asyncio.wait(
+                    {compile_task, browser_done_task},
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+            finally:
+                compile_task.cancel()
+                browser_done_task.cancel()
+            event = next(
+                (
+                    event
+                    for event in agent.sandbox.logs.events_since(compile_seq)
+                    if event.kind in ("compiled", "error")
+                ),
+                None,
+            )
+            if event is None or event.kind != "error":
+                return None
+            # Give the server a moment to print the details
+            await asyncio.sleep(0.5)
+            return "\n".join(agent.sandbox.logs.lines_from(event.line_no, 30))
+
+        # Run lint, browser and dev server checks in parallel
+        (
+            lint_result,
+            (browser_result, browser_screenshot),
+            dev_server_errors,
+        ) = await asyncio.gather(
+            run_lint_check(), run_browser_check(), run_dev_server_check()
         )
+        if dev_server_errors:
+            browser_result += f"\n\nDev server build errors:\n{dev_server_errors}"
 
         # Commit the changes
         await agent.sandbox.commit_changes(commit_message)
@@ -253,6 +346,7 @@ The codeblocks you provided have been applied. Do not provide any more codeblock
             "required": ["navigate_to", "commit_message"],
         },
         func=func,
+        serial=True,
     )
 
 
@@ -484,6 +578,9 @@ class Agent:
         self.sandbox = None
         self.working_page = None
         self.app_temp_url = None
+        # Planning decision of the last step, stored with its reply
+        self.plan_needed: Optional[bool] = None
+        self.plan_reason: Optional[str] = None
 
     def set_sandbox(self, sandbox: DevSandbox):
         self.sandbox = sandbox
@@ -510,8 +607,14 @@ class Agent:
         )
 
     async def suggest_follow_ups(self, messages: List[ChatMessage]) -> List[str]:
+        context_messages = build_context(
+            messages, max_tokens=CONTEXT_FOLLOW_UP_MAX_TOKENS, recent_messages=2
+        )
         conversation_text = "\n\n".join(
-            [f"<{m.role}>{remove_file_changes(m.content)}</{m.role}>" for m in messages]
+            [
+                f"<{m.role}>{remove_file_changes(m.content)}</{m.role}>"
+                for m in context_messages
+            ]
         )
         project_text = self._get_project_text()
         stack_text = self.stack.prompt
@@ -519,13 +622,28 @@ class Agent:
             project_text=project_text,
             stack_text=stack_text,
         )
-        content = await chat_complete(system_prompt, conversation_text[-10000:])
+        content = await chat_complete(system_prompt, conversation_text, cache=True)
         try:
             return _parse_follow_ups(content)
         except Exception:
             print("Error parsing follow ups", content)
             return []
 
+    async def _needs_planning(self, messages: List[ChatMessage]) -> Tuple[bool, str]:
+        if PLANNING_MODE == "always":
+            return True, "always"
+        last_message = messages[-1]
+        try:
+            plan_needed, reason = await needs_planning(
+                remove_file_changes(last_message.content),
+                is_first_message=len(messages) <= 1,
+                has_images=bool(last_message.images),
+            )
+        except Exception as e:
+            print(f"Error routing planning, planning anyway: {e}")
+            plan_needed, reason = True, "router error"
+        return plan_needed, reason
+
     async def _plan(
         self,
         messages: List[ChatMessage],
@@ -539,7 +657,7 @@ class Agent:
             [f"<msg>{remove_file_changes(m.content)}</msg>" for m in messages]
         )
         images = []
-        for m in messages[:-2]:
+        for m in messages:
             if m.images:
                 images.extend(m.images)
 
@@ -576,7 +694,7 @@ class Agent:
             },
         ]
 
-        model = LLM_PROVIDERS[MAIN_PROVIDER]()
+        model = get_llm_provider(MAIN_PROVIDER)
 
         async for chunk in model.chat_complete_with_tools(
             messages=planning_messages,
@@ -618,12 +736,20 @@ class Agent:
         stack_text = self.stack.prompt
         user_text = self._get_user_text()
 
-        plan_content = ""
-        async for chunk in self._plan(
-            messages, project_text, git_log_text, stack_text, files_text, user_text
-        ):
-            yield chunk
-            plan_content += chunk.delta_thinking_content
+        self.plan_needed, self.plan_reason = await self._needs_planning(messages)
+        # Older turns summarized, within the token budget
+        messages = build_context(messages)
+        if self.plan_needed:
+            plan_content = ""
+            async for chunk in self._plan(
+                messages, project_text, git_log_text, stack_text, files_text, user_text
+            ):
+                yield chunk
+                plan_content += chunk.delta_thinking_content
+        else:
+            plan_content = (
+                "No plan needed, this is a small request. Handle it directly."
+            )
 
         system_prompt = SYSTEM_EXEC_PROMPT.format(
             project_text=project_text,
@@ -658,7 +784,12 @@ class Agent:
         diff_applier = AsyncArtifactDiffApplier(self.sandbox)
         apply_cnt = {"cnt": 0}
 
-        tool_cmd = build_run_command_tool(self.sandbox)
+        # Tools run while the model stream is paused, their live output is merged in here
+        stream_queue: asyncio.Queue = asyncio.Queue()
+        tool_cmd = build_run_command_tool(
+            self.sandbox,
+            on_output=lambda text: stream_queue.put_nowait(("tool_output", text)),
+        )
         tool_apply = build_apply_changes_tool(self, diff_applier, apply_cnt)
         tool_screenshot_and_get_logs = build_screenshot_and_get_logs_tool(self)
         tool_read_docs = build_read_docs_tool()
@@ -669,25 +800,53 @@ class Agent:
             tool_read_docs,
         ]
 
-        model = LLM_PROVIDERS[MAIN_PROVIDER]()
-        async for chunk in model.chat_complete_with_tools(
-            messages=exec_messages,
-            tools=tools,
-            model=MAIN_MODEL,
-            temperature=0.0,
-        ):
-            if chunk["type"] == "content":
-                yield PartialChatMessage(
-                    role="assistant", delta_content=chunk["content"]
-                )
-                diff_applier.ingest(chunk["content"])
-            elif chunk["type"] == "tool_calls":
-                for tool_call in chunk["tool_calls"]:
+        model = get_llm_provider(MAIN_PROVIDER)
+
+        async def _pump_model():
+            try:
+                async for chunk in model.chat_complete_with_tools(
+                    messages=exec_messages,
+                    tools=tools,
+                    model=MAIN_MODEL,
+                    temperature=0.0,
+                ):
+                    # Ingested here rather than when the chunk is yielded, the provider
+                    # may run apply_changes before a slow consumer gets to the chunk
+                    if chunk["type"] == "content":
+                        diff_applier.ingest(chunk["content"])
+                    stream_queue.put_nowait(("model", chunk))
+            except Exception as e:
+                stream_queue.put_nowait(("error", e))
+            else:
+                stream_queue.put_nowait(("done", None))
+
+        pump_task = asyncio.create_task(_pump_model())
+        try:
+            while True:
+                kind, item = await stream_queue.get()
+                if kind == "done":
+                    break
+                elif kind == "error":
+                    raise item
+                elif kind == "tool_output":
+                    yield PartialChatMessage(
+                        role="assistant", persist=False, delta_content=item
+                    )
+                    continue
+                chunk = item
+                if chunk["type"] == "content":
                     yield PartialChatMessage(
-                        role="assistant",
-                        persist=False,  # HACK: Show tool calls on UI w/confusing Claude
-                        delta_content=f"\n\n```{tool_call['function']['name']}\n# {tool_call['function']['name']}\n{tool_call['function']['arguments']}\n```\n\n",
+                        role="assistant", delta_content=chunk["content"]
                     )
+                elif chunk["type"] == "tool_calls":
+                    for tool_call in chunk["tool_calls"]:
+                        yield PartialChatMessage(
+                            role="assistant",
+                            persist=False,  # HACK: Show tool calls on UI w/confusing Claude
+                            delta_content=f"\n\n```{tool_call['function']['name']}\n# {tool_call['function']['name']}\n{tool_call['function']['arguments']}\n```\n\n",
+                        )
+        finally:
+            pump_task.cancel()
 
         # manually apply if agent forgot to
         if apply_cnt["cnt"] == 0:
@@ -0,0 +1,151 @@
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import TYPE_CHECKING, List, Optional
+
+from db.database import get_db
+from db.models import Message as DbChatMessage
+from agents.diff import remove_file_changes
+from agents.prompts import summarize_message
+from config import (
+    CONTEXT_MAX_TOKENS,
+    CONTEXT_RECENT_MESSAGES,
+    CONTEXT_IMAGE_MESSAGES,
+    CONTEXT_SUMMARY_MIN_TOKENS,
+)
+
+if TYPE_CHECKING:
+    from agents.agent import ChatMessage
+
+# Rough cost of an attached image, providers bill them at ~1-1.5k tokens
+_IMAGE_TOKENS = 1500
+_SUMMARY_CONCURRENCY = 4
+_SUMMARY_MAX_PER_RUN = 10
+_TOKEN_COUNT_CACHE_SIZE = 4096
+
+_encoding = None
+_encoding_failed = False
+# Keyed on a digest so cached counts don't keep whole messages in memory
+_token_counts: "OrderedDict[bytes, int]" = OrderedDict()
+
+
+def _get_encoding():
+    global _encoding, _encoding_failed
+    if _encoding is None and not _encoding_failed:
+        try:
+            import tiktoken
+
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            print(f"Tokenizer not available, estimating token counts: {e}")
+            _encoding_failed = True
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """Token count of `text`, estimated from its length if the tokenizer can't be loaded."""
+    encoding = _get_encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    key = hashlib.sha1(text.encode("utf-8")).digest()
+    count = _token_counts.get(key)
+    if count is not None:
+        _token_counts.move_to_end(key)
+        return count
+    count = len(encoding.encode(text, disallowed_special=()))
+    _token_counts[key] = count
+    if len(_token_counts) > _TOKEN_COUNT_CACHE_SIZE:
+        _token_counts.popitem(last=False)
+    return count
+
+
+def build_context(
+    messages: List["ChatMessage"],
+    max_tokens: int = CONTEXT_MAX_TOKENS,
+    recent_messages: int = CONTEXT_RECENT_MESSAGES,
+) -> List["ChatMessage"]:
+    """
+    The chat history to send to a model within `max_tokens`.
+
+    The last `recent_messages` messages are kept as is. Older ones are replaced by their
+    summary (or stripped of file changes until they have one) and dropped, oldest first,
+    once the budget is used up. Images are only kept on the last few messages.
+    """
+    context = []
+    used_tokens = 0
+    for i, message in enumerate(reversed(messages)):
+        recent = i < recent_messages
+        if recent:
+            content = message.content
+        elif message.summary:
+            content = f"(Summary of an earlier message) {message.summary}"
+        else:
+            content = remove_file_changes(message.content)
+        images = message.images if i < CONTEXT_IMAGE_MESSAGES else None
+        tokens = count_tokens(content) + _IMAGE_TOKENS * len(images or [])
+        if not recent and used_tokens + tokens > max_tokens:
+            break
+        used_tokens += tokens
+        context.append(
+            message.model_copy(update={"content": content, "images": images})
+        )
+    context.reverse()
+    # Providers expect the conversation to start with the user
+    while len(context) > 1 and context[0].role != "user":
+        context.pop(0)
+    return context
+
+
+def needs_summary(message: DbChatMessage) -> bool:
+    return not message.summary and (
+        count_tokens(message.content) >= CONTEXT_SUMMARY_MIN_TOKENS
+    )
+
+
+async def summarize_older_messages(chat_id: int):
+    """
+    Store summaries for the chat's long messages that will fall out of the recent window
+    on the next turn, so building the context later doesn't wait on them.
+    """
+    db = next(get_db())
+    try:
+        messages = (
+            db.query(DbChatMessage)
+            .filter(DbChatMessage.chat_id == chat_id)
+            .order_by(DbChatMessage.created_at)
+            .all()
+        )
+        # The next turn adds a user and an assistant message
+        older = messages[: max(0, len(messages) - (CONTEXT_RECENT_MESSAGES - 2))]
+        to_summarize = [
+            (m.id, m.role, remove_file_changes(m.content))
+            for m in older
+            if needs_summary(m)
+        ][-_SUMMARY_MAX_PER_RUN:]
+        # Don't hold the transaction open while waiting on the model
+        db.commit()
+        if not to_summarize:
+            return
+        semaphore = asyncio.Semaphore(_SUMMARY_CONCURRENCY)
+
+        async def _summarize(role: str, content: str) -> Optional[str]:
+            async with semaphore:
+                return await summarize_message(role, content)
+
+        summaries = await asyncio.gather(
+            *[_summarize(role, content) for _, role, content in to_summarize],
+            return_exceptions=True,
+        )
+        for (message_id, _, _), summary in zip(to_summarize, summaries):
+            if isinstance(summary, Exception):
+                print(f"Failed to summarize message {message_id}: {summary}")
+            elif summary:
+                db.query(DbChatMessage).filter(DbChatMessage.id == message_id).update(
+                    {"summary": summary}
+                )
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"Error summarizing messages of chat {chat_id}: {e}")
+    finally:
+        db.close()
@@ -1,11 +1,14 @@
-from typing import Dict, List, Optional, Set, Tuple
+from typing import Dict, List, Optional, Tuple
 import re
 import asyncio
+import difflib
 import os
 from asyncio import Task
 
 from sandbox.sandbox import DevSandbox
+from sandbox.lint import ESLINT_CONFIG_PATH, LintResult, is_lint_config, is_lintable
 from agents.prompts import chat_complete
+from config import LINT_REPAIR_MAX_ATTEMPTS
 
 
 def _extract_code_block(content: str) -> str:
@@ -24,6 +27,18 @@ _CODE_BLOCK_PATTERNS = [
     r"```[\w.]+\n<!-- (\S+) -->\n([\s\S]+?)```",  # HTML-style comments <!-- -->
 ]
 
+# Line-level equivalents of _CODE_BLOCK_PATTERNS used by the streaming parser
+_CODE_BLOCK_OPEN_PATTERN = re.compile(r"```[\w.]+$")
+_CODE_BLOCK_HEADER_PATTERNS = [
+    re.compile(r"^[#/]+ (\S+)$"),
+    re.compile(r"^[/*]+ (\S+) \*/$"),
+    re.compile(r"^<!-- (\S+) -->$"),
+]
+
+_PLACEHOLDER_LINE_PATTERN = re.compile(r"^\s*(?://|#|/\*|\{/\*|<!--)\s*\.\.\.")
+# Placeholders describing deleted code can't be merged by anchoring
+_PLACEHOLDER_REMOVAL_WORDS = ("remov", "delet")
+
 _DIFF_TIPS = {
     r"<Link[^>]*>[\S\s]*?<a[^>]*>": "All <Link> tags should be free of <a> tags. Remove all <a> tags from <Link> tags.",
     "<CardBody": "Ensure in Shadcn UI, <Card>s use <CardContent> instead of <CardBody>.",
@@ -47,6 +62,10 @@ _EXT_TO_MARKDOWN_LANGUAGE = {
 }
 
 
+def _diff_tips(diff: str) -> List[str]:
+    return [tip for pattern, tip in _DIFF_TIPS.items() if re.search(pattern, diff)]
+
+
 async def _apply_smart_diff(
     original_content: str,
     diff: str,
@@ -89,16 +108,203 @@ Respond ONLY with the updated content in a code block.
 {tips}
 </adjustments>
 """.strip(),
+        cache=True,
     )
     return _extract_code_block(output)
 
 
+def _is_placeholder_line(line: str) -> bool:
+    return _PLACEHOLDER_LINE_PATTERN.match(line) is not None
+
+
+def _trim_blank_lines(lines: List[str]) -> List[str]:
+    start, end = 0, len(lines)
+    while start < end and not lines[start].strip():
+        start += 1
+    while end > start and not lines[end - 1].strip():
+        end -= 1
+    return lines[start:end]
+
+
+def _match_hunk(
+    keys: List[str],
+    window: List[int],
+    hunk_keys: List[str],
+    is_first: bool,
+    is_last: bool,
+) -> Optional[int]:
+    """
+    Line up the non-blank `hunk_keys` with the original lines at the `window` indices and
+    return the end of the span they replace, None if the hunk doesn't fit there.
+
+    Lines found in both are unchanged context. A hunk must start on context unless it is the
+    first one and end on context unless it is the last one, and no original line may be
+    dropped without a hunk line taking its place (deletions need the LLM).
+    """
+    matcher = difflib.SequenceMatcher(
+        None, hunk_keys, [keys[j] for j in window], autojunk=False
+    )
+    pairs = [
+        (block.a + n, block.b + n)
+        for block in matcher.get_matching_blocks()
+        for n in range(block.size)
+    ]
+    if not pairs:
+        return None
+    if not is_first and pairs[0] != (0, 0):
+        return None
+    if not is_last and pairs[-1][0] != len(hunk_keys) - 1:
+        return None
+    prev_h, prev_o = -1, -1
+    for h, o in pairs:
+        if o - prev_o > h - prev_h:
+            return None
+        prev_h, prev_o = h, o
+    if is_last:
+        if len(window) - prev_o > len(hunk_keys) - prev_h:
+            return None
+        return window[-1] + 1
+    return window[prev_o] + 1
+
+
+def _apply_local_patch(original_content: str, diff: str) -> Optional[str]:
+    """
+    Splice the hunks of a diff with "... existing code ..." style placeholders into the
+    original content, locating each hunk by its unchanged context lines.
+
+    Returns None when a hunk doesn't line up with exactly one span of the original so the
+    caller can fall back to the LLM. This includes hunks between two placeholders that
+    start or end on a new line, as there is no context to place them by.
+    """
+    hunks: List[List[str]] = [[]]
+    for line in diff.split("\n"):
+        if _is_placeholder_line(line):
+            if any(word in line.lower() for word in _PLACEHOLDER_REMOVAL_WORDS):
+                return None
+            hunks.append([])
+        else:
+            hunks[-1].append(line)
+    if len(hunks) == 1:
+        return None
+
+    original_lines = original_content.split("\n")
+    keys = [line.strip() for line in original_lines]
+    non_blank = [i for i, key in enumerate(keys) if key]
+
+    output: List[str] = []
+    cursor = 0
+    for i, hunk in enumerate(hunks):
+        hunk = _trim_blank_lines(hunk)
+        if not hunk:
+            continue
+        hunk_keys = [line.strip() for line in hunk if line.strip()]
+        # No placeholder before the first hunk or after the last one, so they are pinned
+        # to the top and bottom of the file
+        is_first, is_last = i == 0, i == len(hunks) - 1
+        region = [j for j in non_blank if j >= cursor]
+        if is_first:
+            candidates = [0] if region else []
+        else:
+            candidates = [c for c, j in enumerate(region) if keys[j] == hunk_keys[0]]
+
+        spans = set()
+        for c in candidates:
+            window = region[c:] if is_last else region[c : c + len(hunk_keys)]
+            if len(window) > len(hunk_keys):
+                continue
+            end = _match_hunk(keys, window, hunk_keys, is_first, is_last)
+            if end is not None:
+                spans.add((window[0], end))
+        if len(spans) != 1:
+            return None
+        start, end = spans.pop()
+
+        output.extend(original_lines[cursor:start])
+        output.extend(hunk)
+        cursor = end
+    output.extend(original_lines[cursor:])
+    return "\n".join(output)
+
+
 def remove_file_changes(content: str) -> str:
     for pattern in _CODE_BLOCK_PATTERNS:
         content = re.sub(pattern, "", content)
     return content
 
 
+class _CodeBlockParser:
+    """
+    Incrementally parses streamed content for file code blocks.
+
+    Only newly fed text is scanned. A (file_path, diff) pair is returned as soon as the
+    closing fence of a block with a file path header has been seen.
+    """
+
+    _OUTSIDE = "outside"
+    _HEADER = "header"
+    _BLOCK = "block"
+    _SKIP = "skip"
+
+    def __init__(self):
+        self._state = self._OUTSIDE
+        self._partial_line = ""
+        self._fence_scan_pos = 0
+        self._file_path: Optional[str] = None
+        self._block_lines: List[str] = []
+
+    def feed(self, content: str) -> List[Tuple[str, str]]:
+        completed = []
+        lines = (self._partial_line + content).split("\n")
+        self._partial_line = lines.pop()
+        for line in lines:
+            self._fence_scan_pos = 0
+            self._on_line(line, completed)
+
+        # Close blocks without waiting for the newline after the fence
+        if self._state in (self._BLOCK, self._SKIP):
+            idx = self._partial_line.find("```", self._fence_scan_pos)
+            if idx >= 0:
+                self._on_line(self._partial_line, completed)
+                self._partial_line = ""
+                self._fence_scan_pos = 0
+            else:
+                self._fence_scan_pos = max(0, len(self._partial_line) - 2)
+        return completed
+
+    def _on_line(self, line: str, completed: List[Tuple[str, str]]):
+        if self._state == self._OUTSIDE:
+            if _CODE_BLOCK_OPEN_PATTERN.search(line):
+                self._state = self._HEADER
+        elif self._state == self._HEADER:
+            match = next(
+                (m for m in (p.match(line) for p in _CODE_BLOCK_HEADER_PATTERNS) if m),
+                None,
+            )
+            if match:
+                self._state = self._BLOCK
+                self._file_path = match.group(1)
+                self._block_lines = []
+            elif "```" in line:
+                self._state = self._OUTSIDE
+            else:
+                self._state = self._SKIP
+        elif self._state == self._BLOCK:
+            idx = line.find("```")
+            if idx < 0:
+                self._block_lines.append(line)
+                return
+            self._block_lines.append(line[:idx])
+            diff = "\n".join(self._block_lines).strip()
+            if diff:
+                completed.append((self._file_path, diff))
+            self._state = self._OUTSIDE
+            self._file_path = None
+            self._block_lines = []
+        elif self._state == self._SKIP:
+            if "```" in line:
+                self._state = self._OUTSIDE
+
+
 class AsyncArtifactDiffApplier:
     """
     A utility class that asynchronously applies code changes to files in a sandbox environment.
@@ -107,55 +313,47 @@ class AsyncArtifactDiffApplier:
     diffs, and then asynchronously computes and applies these diffs to the files in the sandbox.
 
     It handles:
-    - Parsing code blocks from content
-    - Tracking which diffs have been processed
-    - Asynchronously computing diffs with smart adjustments
+    - Incrementally parsing code blocks from streamed content
+    - Asynchronously computing diffs, merging placeholder diffs locally when the anchors
+      are unambiguous and falling back to a smart (LLM) merge otherwise
     - Applying changes to files in the sandbox
     """
 
     def __init__(self, sandbox: DevSandbox):
         self.sandbox = sandbox
-        self._total_content: str = ""
+        self._parser = _CodeBlockParser()
         self._path_to_diff: Dict[str, str] = {}  # path -> diff
-        self._path_to_task: Dict[str, Task[str]] = {}  # path -> Task
-        self._processed_positions: Set[Tuple[str, int]] = (
-            set()
-        )  # Set of (file_path, start_pos) tuples
+        self._path_to_task: Dict[str, Task[str]] = {}  # path -> Task (new content)
+        self.path_to_strategy: Dict[str, str] = {}  # path -> direct, local or smart
+        self._path_to_original: Dict[str, str] = {}  # path -> content before the diff
+        self.last_applied_strategies: Dict[str, str] = {}
+        # Lint of the files last applied, None if it wasn't run as part of applying
+        self.last_lint: Optional[LintResult] = None
 
     def ingest(self, content: str) -> None:
-        self._total_content += content
-
-        for pattern in _CODE_BLOCK_PATTERNS:
-            matches = re.finditer(pattern, self._total_content)
-            for match in matches:
-                file_path = match.group(1)
-                diff = match.group(2).strip()
-                # Calculate absolute position in total content
-                abs_start = match.start()
-
-                # Skip if we've already processed this match
-                if (file_path, abs_start) in self._processed_positions:
-                    continue
-
-                self._processed_positions.add((file_path, abs_start))
-                self._path_to_diff[file_path] = diff
-                # Kickoff async task to compute the smart diff
-                self._path_to_task[file_path] = asyncio.create_task(
-                    self._compute_diff(file_path, diff)
-                )
+        for file_path, diff in self._parser.feed(content):
+            self._path_to_diff[file_path] = diff
+            if file_path in self._path_to_task:
+                # A later block for the same file supersedes the earlier one
+                self._path_to_task[file_path].cancel()
+            # Kickoff async task to compute the smart diff
+            self._path_to_task[file_path] = asyncio.create_task(
+                self._compute_diff(file_path, diff)
+            )
 
     async def _compute_diff(
         self, file_path: str, diff: str, lint_output: Optional[str] = None
     ) -> str:
-        tips = []
-        for pattern, tip in _DIFF_TIPS.items():
-            if re.search(pattern, diff):
-                tips.append(tip)
+        """Compute the full new content of `file_path` from the diff."""
+        tips = _diff_tips(diff)
 
         try:
             original_content = await self.sandbox.read_file_contents(file_path)
+            original_exists = True
         except Exception:
             original_content = "(file does not yet exist)"
+            original_exists = False
+        self._path_to_original[file_path] = original_content
 
         skip_conditions = [
             "... (" not in diff,
@@ -167,11 +365,24 @@ class AsyncArtifactDiffApplier:
             "the same..." not in diff,
             len(tips) == 0,
         ]
+        local_patch_allowed = (
+            original_exists
+            and len(tips) == 0
+            and "Add this at" not in diff
+            and "the same..." not in diff
+        )
         if all(skip_conditions):
             print(f"Writing {file_path} directly...")
+            self.path_to_strategy[file_path] = "direct"
             full_content = diff
+        elif local_patch_allowed and (
+            (full_content := _apply_local_patch(original_content, diff)) is not None
+        ):
+            print(f"Writing {file_path} local patch...")
+            self.path_to_strategy[file_path] = "local"
         else:
             print(f"Writing {file_path} smart diff...", skip_conditions, tips)
+            self.path_to_strategy[file_path] = "smart"
             full_content = await _apply_smart_diff(
                 original_content,
                 diff,
@@ -179,10 +390,85 @@ class AsyncArtifactDiffApplier:
                 file_path,
                 lint_output=lint_output,
             )
-        await self.sandbox.write_file(file_path, full_content)
+        return full_content
+
+    async def _repair_lint(self, file_paths: List[str]) -> Optional[LintResult]:
+        """
+        Re-run the smart diff of files failing their targeted lint, with the lint output as a tip.
+
+        Returns the lint of `file_paths` as they were left, None if it isn't known.
+        """
+        if any(is_lint_config(path) for path in file_paths):
+            # Per-file results can't be trusted until the whole project is linted again
+            return None
+        if not await self.sandbox.has_file(ESLINT_CONFIG_PATH):
+            return None
+        pending = [
+            path
+            for path in file_paths
+            if is_lintable(path) and path in self._path_to_original
+        ]
+        lint_by_path: Dict[str, LintResult] = {}
+        # The last round only lints, so the result covers the final repairs
+        for attempt in range(LINT_REPAIR_MAX_ATTEMPTS + 1):
+            if not pending:
+                break
+            lints = await asyncio.gather(
+                *[self.sandbox.lint([path]) for path in pending]
+            )
+            lint_by_path.update(zip(pending, lints))
+            failing = [
+                (path, lint.output)
+                for path, lint in zip(pending, lints)
+                if lint.mode == "incremental" and lint.has_errors
+            ]
+            if not failing or attempt == LINT_REPAIR_MAX_ATTEMPTS:
+                break
+            print(
+                f"Repairing lint errors (attempt {attempt + 1}): {[path for path, _ in failing]}"
+            )
+            repaired = await asyncio.gather(
+                *[
+                    _apply_smart_diff(
+                        self._path_to_original[path],
+                        self._path_to_diff[path],
+                        "\n".join(
+                            [f" - {t}" for t in _diff_tips(self._path_to_diff[path])]
+                        ),
+                        path,
+                        lint_output=lint_output,
+                    )
+                    for path, lint_output in failing
+                ],
+                return_exceptions=True,
+            )
+            files_to_write = [
+                (path, content)
+                for (path, _), content in zip(failing, repaired)
+                if isinstance(content, str)
+            ]
+            await self.sandbox.write_files(files_to_write)
+            for path, _ in files_to_write:
+                strategy = self.path_to_strategy.get(path, "unknown")
+                if not strategy.endswith("+lint_repair"):
+                    self.path_to_strategy[path] = strategy + "+lint_repair"
+            pending = [path for path, _ in files_to_write]
+
+        lints = list(lint_by_path.values())
+        if any(lint.mode not in ("incremental", "skipped") for lint in lints):
+            # A full lint covers the whole project, not just these files
+            return None
+        if not any(lint.mode == "incremental" for lint in lints):
+            return LintResult(output="", has_errors=False, mode="skipped")
+        return LintResult(
+            output="\n".join(lint.output for lint in lints if lint.output),
+            has_errors=any(lint.has_errors for lint in lints),
+            mode="incremental",
+        )
 
     async def apply(self) -> List[str]:
         """Wait for all pending diffs to complete and return the list of processed file paths."""
+        self.last_lint = None
         if not self._path_to_task:
             return []
 
@@ -190,17 +476,36 @@ class AsyncArtifactDiffApplier:
         results: List[str | Exception] = await asyncio.gather(
             *self._path_to_task.values(), return_exceptions=True
         )
-        processed_files: List[str] = []
+        files_to_write: List[Tuple[str, str]] = []
         for (file_path, task), result in zip(self._path_to_task.items(), results):
             if isinstance(result, Exception):
                 print(f"Error processing {file_path}: {result}")
             else:
-                processed_files.append(file_path)
+                files_to_write.append((file_path, result))
+
+        processed_files: List[str] = []
+        try:
+            await self.sandbox.write_files(files_to_write)
+            processed_files = [file_path for file_path, _ in files_to_write]
+        except Exception as e:
+            print(f"Error writing {[path for path, _ in files_to_write]}: {e}")
+
+        if processed_files:
+            try:
+                self.last_lint = await self._repair_lint(processed_files)
+            except Exception as e:
+                print(f"Error repairing lint: {e}")
+
+        self.last_applied_strategies = {
+            path: self.path_to_strategy.get(path, "unknown") for path in processed_files
+        }
+        print(f"Applied changes: {self.last_applied_strategies}")
 
         # reset
-        self._total_content = ""
+        self._parser = _CodeBlockParser()
         self._path_to_diff = {}
         self._path_to_task = {}
-        self._processed_positions = set()
+        self.path_to_strategy = {}
+        self._path_to_original = {}
 
         return processed_files
@@ -1,9 +1,11 @@
 import datetime
 import re
-from typing import List, Tuple
+from collections import OrderedDict
+from typing import List, Optional, Tuple
 
 from config import FAST_MODEL, MAIN_MODEL, FAST_PROVIDER
-from agents.providers import LLM_PROVIDERS
+from agents.providers import get_llm_provider
+from agents.response_cache import response_cache
 
 
 async def chat_complete(
@@ -11,11 +13,21 @@ async def chat_complete(
     user_prompt: str,
     fast: bool = True,
     temperature: float = 0.0,
+    cache: bool = False,
 ) -> str:
+    """Complete a single prompt, `cache` reuses earlier answers for identical inputs (at temperature 0)."""
     model = FAST_MODEL if fast else MAIN_MODEL
-    return await LLM_PROVIDERS[FAST_PROVIDER]().chat_complete(
+    cache_key = None
+    if cache and temperature == 0.0:
+        cache_key = response_cache.key(FAST_PROVIDER, model, system_prompt, user_prompt)
+        if (content := await response_cache.get(cache_key)) is not None:
+            return content
+    content = await get_llm_provider(FAST_PROVIDER).chat_complete(
         system_prompt, user_prompt, model, temperature
     )
+    if cache_key is not None and content:
+        await response_cache.put(cache_key, content)
+    return content
 
 
 async def name_chat(seed_prompt: str) -> Tuple[str, str, str]:
@@ -44,7 +56,7 @@ session: Build the UI for Astro App
 </example>
 """
     user_prompt = seed_prompt
-    content = await chat_complete(system_prompt, user_prompt)
+    content = await chat_complete(system_prompt, user_prompt, cache=True)
     try:
         project, project_description, session = re.search(
             r"project: (.*)\nproject-description: (.*)\nsession: (.*)", content
@@ -60,7 +72,75 @@ session: Build the UI for Astro App
     return project, project_description, session
 
 
+# Prompts naming a stack (or its main library) get that stack
+_STACK_MENTION_PATTERNS = {
+    "p5.js": re.compile(r"\bp5(\.js|js)?\b"),
+    "Pixi.js": re.compile(r"\bpixi(\.js|js)?\b"),
+    "Angular": re.compile(r"\bangular\b"),
+    "Next.js Shadcn": re.compile(r"\bshadcn\b"),
+}
+
+# Otherwise the kind of project decides, only if it points at a single stack
+_STACK_KEYWORD_PATTERNS = {
+    "p5.js": re.compile(
+        r"\b(generative art|creative coding|fractals?|particles?|flocking|boids|"
+        r"game of life|cellular automat\w*|perlin noise|simulations?|sketch)\b"
+    ),
+    "Next.js Shadcn": re.compile(
+        r"\b(dashboard|landing page|website|web ?app|saas|crm|admin panel|portfolio|"
+        r"blog|todo|to-do|form|signup|sign up|login|e-?commerce|store|shop)\b"
+    ),
+}
+
+_STACK_CACHE_MAX_ENTRIES = 1024
+_stack_cache: "OrderedDict[str, str]" = OrderedDict()
+
+
+def _normalize_seed_prompt(seed_prompt: str) -> str:
+    return " ".join(seed_prompt.lower().split())
+
+
+def classify_stack(seed_prompt: str, stack_titles: List[str]) -> Optional[str]:
+    """
+    Pick the stack locally when the answer is clear, from past decisions for the same prompt
+    or keyword rules. Returns None when unsure (and the LLM should decide).
+    """
+    prompt = _normalize_seed_prompt(seed_prompt)
+    if prompt in _stack_cache and _stack_cache[prompt] in stack_titles:
+        _stack_cache.move_to_end(prompt)
+        return _stack_cache[prompt]
+    for patterns in (_STACK_MENTION_PATTERNS, _STACK_KEYWORD_PATTERNS):
+        matches = {
+            title
+            for title, pattern in patterns.items()
+            if title in stack_titles and pattern.search(prompt)
+        }
+        if len(matches) == 1:
+            return matches.pop()
+        if matches:
+            return None
+    return None
+
+
+def _remember_stack(seed_prompt: str, title: str):
+    prompt = _normalize_seed_prompt(seed_prompt)
+    _stack_cache[prompt] = title
+    _stack_cache.move_to_end(prompt)
+    while len(_stack_cache) > _STACK_CACHE_MAX_ENTRIES:
+        _stack_cache.popitem(last=False)
+
+
 async def pick_stack(seed_prompt: str, stack_titles: List[str], default: str) -> str:
+    title = classify_stack(seed_prompt, stack_titles)
+    if title is None:
+        title = await _pick_stack_with_llm(seed_prompt, stack_titles, default)
+    _remember_stack(seed_prompt, title)
+    return title
+
+
+async def _pick_stack_with_llm(
+    seed_prompt: str, stack_titles: List[str], default: str
+) -> str:
     system_prompt = f"""
 You are a helpful full-stack developer helping advise a user on which stack to use.
 
@@ -82,7 +162,7 @@ stack: ...
 
 Respond with <output-format> without the tags.
 """
-    content = await chat_complete(system_prompt, seed_prompt)
+    content = await chat_complete(system_prompt, seed_prompt, cache=True)
     try:
         # Extract stack from response
         stack = re.search(r"stack: (.*)", content).group(1).strip()
@@ -93,3 +173,75 @@ Respond with <output-format> without the tags.
         return stack_map.get(normalized_input, default)
     except Exception:
         return default
+
+
+# Requests that clearly span several files or features, these always get a plan
+_PLAN_PATTERNS = re.compile(
+    r"\b(build|create|implement|add (a |an )?(new )?(page|feature|section|screen|component)|"
+    r"feature|refactor|redesign|rewrite|restructure|integrate|migrate|from scratch|"
+    r"multiple|several|all (the )?pages|authentication|database|api)\b"
+)
+# Small, local edits
+_TRIVIAL_EDIT_PATTERNS = re.compile(
+    r"\b(colou?r|font|text|wording|copy|rename|typo|spacing|padding|margin|size|"
+    r"bigger|smaller|larger|align|center|centre|bold|italic|border|shadow|rounded|"
+    r"icon|emoji|title|label|placeholder|background)\b"
+)
+_QUESTION_PATTERN = re.compile(
+    r"^(what|why|how|where|which|who|can|could|is|are|does|do|should)\b.*\?$"
+)
+_TRIVIAL_MAX_CHARS = 200
+_PLAN_MIN_CHARS = 500
+
+
+def _classify_planning_locally(request: str) -> Optional[Tuple[bool, str]]:
+    text = " ".join(request.lower().split())
+    if len(text) >= _PLAN_MIN_CHARS:
+        return True, "long request"
+    if _PLAN_PATTERNS.search(text):
+        return True, "multi-part request"
+    if len(text) <= _TRIVIAL_MAX_CHARS:
+        if _QUESTION_PATTERN.search(text):
+            return False, "question"
+        if _TRIVIAL_EDIT_PATTERNS.search(text):
+            return False, "small edit"
+    return None
+
+
+async def needs_planning(
+    request: str, is_first_message: bool, has_images: bool
+) -> Tuple[bool, str]:
+    """
+    Decide whether a request is worth a planning pass, returning (plan, reason).
+
+    Clear cases are decided locally, the rest by the fast model.
+    """
+    if is_first_message:
+        return True, "first message"
+    if has_images:
+        return True, "has images"
+    if (decision := _classify_planning_locally(request)) is not None:
+        return decision
+
+    system_prompt = """
+You are routing requests to a coding agent working on a web app.
+
+Decide whether the user's request needs an upfront plan. Requests that touch several files, add features or need design decisions need a PLAN. Small, self-contained edits (one component, styles, copy) and questions about the app are DIRECT.
+
+Respond with only PLAN or DIRECT.
+""".strip()
+    content = await chat_complete(system_prompt, request, cache=True)
+    if "DIRECT" in content.upper() and "PLAN" not in content.upper():
+        return False, "fast model"
+    return True, "fast model"
+
+
+async def summarize_message(role: str, content: str) -> str:
+    system_prompt = f"""
+You are condensing an earlier message from a chat between a user and a coding agent building an app, so it can stand in for the original later in the conversation.
+
+Summarize the {role} message in a few sentences. Keep requests, decisions, file/component names and anything still relevant later. Skip pleasantries and code.
+
+Respond with only the summary.
+""".strip()
+    return (await chat_complete(system_prompt, content, cache=True)).strip()
@@ -1,8 +1,11 @@
 from abc import ABC, abstractmethod
-from typing import Dict, Any, List, AsyncGenerator, Callable, Type
+from typing import Dict, Any, List, AsyncGenerator, Callable, Optional, Tuple, Type
 from pydantic import BaseModel
 import json
 import copy
+import asyncio
+import openai
+import anthropic
 from openai import AsyncOpenAI
 from anthropic import AsyncAnthropic
 from config import (
@@ -10,6 +13,8 @@ from config import (
     ANTHROPIC_API_KEY,
     OPENAI_BASE_URL,
     ANTHROPIC_BASE_URL,
+    LLM_HTTP_MAX_CONNECTIONS,
+    LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS,
 )
 import base64
 import httpx
@@ -20,6 +25,8 @@ class AgentTool(BaseModel):
     description: str
     parameters: Dict[str, Any]
     func: Callable
+    # Serial tools run alone (in order) instead of alongside other tool calls from the same turn
+    serial: bool = False
 
     def to_oai_tool(self):
         return {
@@ -43,7 +50,49 @@ class AgentTool(BaseModel):
         }
 
 
+def _http_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=LLM_HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    )
+
+
 class LLMProvider(ABC):
+    async def close(self) -> None:
+        pass
+
+    @abstractmethod
+    async def _handle_tool_call(self, tools: List[AgentTool], tool_call) -> Any:
+        pass
+
+    @abstractmethod
+    def _tool_call_name(self, tool_call) -> str:
+        pass
+
+    async def _run_tool_calls(self, tools: List[AgentTool], tool_calls: List) -> List:
+        """Run the tool calls of a turn, overlapping independent calls. Results keep the call order."""
+        results = [None] * len(tool_calls)
+        pending: List[int] = []
+
+        async def _run_pending():
+            outputs = await asyncio.gather(
+                *[self._handle_tool_call(tools, tool_calls[i]) for i in pending]
+            )
+            for i, output in zip(pending, outputs):
+                results[i] = output
+            pending.clear()
+
+        for i, tool_call in enumerate(tool_calls):
+            name = self._tool_call_name(tool_call)
+            tool = next((tool for tool in tools if tool.name == name), None)
+            if tool is not None and tool.serial:
+                await _run_pending()
+                results[i] = await self._handle_tool_call(tools, tool_call)
+            else:
+                pending.append(i)
+        await _run_pending()
+        return results
+
     @abstractmethod
     async def chat_complete(
         self, system_prompt: str, user_prompt: str, model: str, temperature: float = 0.0
@@ -62,8 +111,14 @@ class LLMProvider(ABC):
 
 
 class OpenAILLMProvider(LLMProvider):
-    def __init__(self):
-        self.client = AsyncOpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL)
+    def __init__(self, base_url: Optional[str] = OPENAI_BASE_URL):
+        self.http_client = openai.DefaultAsyncHttpxClient(limits=_http_limits())
+        self.client = AsyncOpenAI(
+            api_key=OPENAI_API_KEY, base_url=base_url, http_client=self.http_client
+        )
+
+    async def close(self) -> None:
+        await self.client.close()
 
     async def chat_complete(
         self, system_prompt: str, user_prompt: str, model: str, temperature: float = 0.0
@@ -78,6 +133,9 @@ class OpenAILLMProvider(LLMProvider):
         )
         return resp.choices[0].message.content
 
+    def _tool_call_name(self, tool_call) -> str:
+        return tool_call.function.name
+
     async def _handle_tool_call(self, tools: List[AgentTool], tool_call) -> str:
         # Default implementation for OpenAI format
         tool_name = tool_call.function.name
@@ -165,8 +223,8 @@ class OpenAILLMProvider(LLMProvider):
                             "tool_calls": tool_calls_buffer,
                         }
                     )
-                    for tool_call in tool_calls_buffer:
-                        tool_result = await self._handle_tool_call(tools, tool_call)
+                    tool_results = await self._run_tool_calls(tools, tool_calls_buffer)
+                    for tool_call, tool_result in zip(tool_calls_buffer, tool_results):
                         oai_messages.append(
                             {
                                 "role": "tool",
@@ -211,12 +269,15 @@ def _guess_cache_anthropic_cache_control(params: Dict[str, Any]) -> Dict[str, An
 
 
 class AnthropicLLMProvider(LLMProvider):
-    def __init__(self):
+    def __init__(self, base_url: Optional[str] = ANTHROPIC_BASE_URL):
+        # Pooled httpx client shared by the API client and image fetching
+        self.http_client = anthropic.DefaultAsyncHttpxClient(limits=_http_limits())
         self.client = AsyncAnthropic(
-            api_key=ANTHROPIC_API_KEY, base_url=ANTHROPIC_BASE_URL
+            api_key=ANTHROPIC_API_KEY, base_url=base_url, http_client=self.http_client
         )
-        # Create a shared httpx client for image fetching
-        self.http_client = httpx.AsyncClient()
+
+    async def close(self) -> None:
+        await self.client.close()
 
     async def _fetch_and_encode_image(self, url: str) -> tuple[str, str]:
         """Fetch image from URL and return (media_type, base64_data)"""
@@ -312,6 +373,7 @@ class AnthropicLLMProvider(LLMProvider):
             stream = await self.client.messages.create(**create_params)
 
             tool_calls_buffer = []
+            displayed_tool_calls_cnt = 0
             content_buffer = ""
 
             async for chunk in stream:
@@ -347,59 +409,13 @@ class AnthropicLLMProvider(LLMProvider):
                                 ] += chunk.delta.partial_json
 
                 elif chunk.type == "content_block_stop":
-                    if tool_calls_buffer:
-                        # Yield all tool calls at once
+                    if len(tool_calls_buffer) > displayed_tool_calls_cnt:
+                        # Yield tool calls as soon as their block is complete
                         yield {
                             "type": "tool_calls",
-                            "tool_calls": tool_calls_buffer,
+                            "tool_calls": tool_calls_buffer[displayed_tool_calls_cnt:],
                         }
-                        # Process all tool calls in buffer
-                        for tool_call in tool_calls_buffer:
-
-                            arguments_dict = json.loads(
-                                tool_call["function"]["arguments"]
-                            )
-                            tool_result = await self._handle_tool_call(tools, tool_call)
-
-                            # Add tool use message
-                            current_messages.append(
-                                {
-                                    "role": "assistant",
-                                    "content": [
-                                        {
-                                            "type": "tool_use",
-                                            "id": tool_call["id"],
-                                            "name": tool_call["function"]["name"],
-                                            "input": arguments_dict,
-                                        }
-                                    ],
-                                }
-                            )
-
-                            # Add tool result message
-                            current_messages.append(
-                                {
-                                    "role": "user",
-                                    "content": [
-                                        {
-                                            "type": "tool_result",
-                                            "tool_use_id": tool_call["id"],
-                                            "content": (
-                                                tool_result
-                                                if isinstance(tool_result, list)
-                                                else [
-                                                    {
-                                                        "type": "text",
-                                                        "text": tool_result,
-                                                    }
-                                                ]
-                                            ),
-                                        }
-                                    ],
-                                }
-                            )
-                        tool_calls_buffer = []
-                        content_buffer = ""
+                        displayed_tool_calls_cnt = len(tool_calls_buffer)
                 elif (
                     chunk.type == "message_delta"
                     and chunk.delta.stop_reason == "end_turn"
@@ -410,12 +426,59 @@ class AnthropicLLMProvider(LLMProvider):
                     chunk.type == "message_delta"
                     and chunk.delta.stop_reason == "tool_use"
                 ):
-                    pass
+                    # Process all tool calls in buffer
+                    tool_results = await self._run_tool_calls(tools, tool_calls_buffer)
+                    for tool_call, tool_result in zip(tool_calls_buffer, tool_results):
+                        arguments_dict = json.loads(tool_call["function"]["arguments"])
+
+                        # Add tool use message
+                        current_messages.append(
+                            {
+                                "role": "assistant",
+                                "content": [
+                                    {
+                                        "type": "tool_use",
+                                        "id": tool_call["id"],
+                                        "name": tool_call["function"]["name"],
+                                        "input": arguments_dict,
+                                    }
+                                ],
+                            }
+                        )
+
+                        # Add tool result message
+                        current_messages.append(
+                            {
+                                "role": "user",
+                                "content": [
+                                    {
+                                        "type": "tool_result",
+                                        "tool_use_id": tool_call["id"],
+                                        "content": (
+                                            tool_result
+                                            if isinstance(tool_result, list)
+                                            else [
+                                                {
+                                                    "type": "text",
+                                                    "text": tool_result,
+                                                }
+                                            ]
+                                        ),
+                                    }
+                                ],
+                            }
+                        )
+                    tool_calls_buffer = []
+                    displayed_tool_calls_cnt = 0
+                    content_buffer = ""
                 elif chunk.type == "message_stop":
                     pass
                 else:
                     print(f"Unhandled anthropic chunk: {chunk}")
 
+    def _tool_call_name(self, tool_call) -> str:
+        return tool_call["function"]["name"]
+
     async def _handle_tool_call(self, tools: List[AgentTool], tool_call) -> str:
         # Anthropic specific implementation
         tool_name = tool_call["function"]["name"]
@@ -439,3 +502,29 @@ LLM_PROVIDERS: Dict[str, Type[LLMProvider]] = {
     "openai": OpenAILLMProvider,
     "anthropic": AnthropicLLMProvider,
 }
+
+_PROVIDER_BASE_URLS: Dict[str, Optional[str]] = {
+    "openai": OPENAI_BASE_URL,
+    "anthropic": ANTHROPIC_BASE_URL,
+}
+
+_provider_instances: Dict[Tuple[str, Optional[str]], LLMProvider] = {}
+
+
+def get_llm_provider(name: str, base_url: Optional[str] = None) -> LLMProvider:
+    """Get the long-lived (connection pooled) provider for `name` and base URL."""
+    base_url = base_url or _PROVIDER_BASE_URLS.get(name)
+    key = (name, base_url)
+    if key not in _provider_instances:
+        _provider_instances[key] = LLM_PROVIDERS[name](base_url=base_url)
+    return _provider_instances[key]
+
+
+async def close_llm_providers() -> None:
+    providers = list(_provider_instances.values())
+    _provider_instances.clear()
+    for provider in providers:
+        try:
+            await provider.close()
+        except Exception as e:
+            print(f"Error closing LLM provider: {e}")
@@ -0,0 +1,171 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from config import (
+    RESPONSE_CACHE_MAX_ENTRIES,
+    RESPONSE_CACHE_MAX_BYTES,
+    RESPONSE_CACHE_TTL_SECONDS,
+    RESPONSE_CACHE_DISK_DIR,
+    RESPONSE_CACHE_DISK_MAX_ENTRIES,
+)
+
+# Print the hit rate every this many lookups
+_STATS_LOG_INTERVAL = 100
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Cache of deterministic (temperature 0) completions.
+
+    Keyed on (provider, model, system prompt hash, user prompt hash). Entries expire after
+    `ttl_seconds` and live in a size bounded in-memory LRU, backed by an optional directory
+    on disk so they survive restarts and are shared by workers on the same machine.
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        max_bytes: int,
+        ttl_seconds: int,
+        disk_dir: Optional[str] = None,
+        disk_max_entries: int = 0,
+    ):
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._ttl_seconds = ttl_seconds
+        self._disk_dir = disk_dir
+        self._disk_max_entries = disk_max_entries
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._bytes = 0
+        self._disk_writes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @staticmethod
+    def key(provider: str, model: str, system_prompt: str, user_prompt: str) -> str:
+        return _sha256(
+            "\0".join([provider, model, _sha256(system_prompt), _sha256(user_prompt)])
+        )
+
+    def _remember(self, key: str, expires_at: float, value: str):
+        if key in self._entries:
+            self._bytes -= len(self._entries.pop(key)[1])
+        if len(value) > self._max_bytes:
+            return
+        self._entries[key] = (expires_at, value)
+        self._bytes += len(value)
+        while len(self._entries) > self._max_entries or self._bytes > self._max_bytes:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self._bytes -= len(evicted)
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self._disk_dir, f"{key}.json")
+
+    def _read_disk(self, key: str) -> Optional[Tuple[float, str]]:
+        try:
+            with open(self._disk_path(key), "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return data["expires_at"], data["value"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _write_disk(self, key: str, expires_at: float, value: str):
+        tmp_path = f"{self._disk_path(key)}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"expires_at": expires_at, "value": value}, f)
+        os.replace(tmp_path, self._disk_path(key))
+
+    def _prune_disk(self):
+        """Drop expired entries, then the oldest ones past `disk_max_entries`."""
+        now = time.time()
+        paths = []
+        for name in os.listdir(self._disk_dir):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self._disk_dir, name)
+            try:
+                mtime = os.path.getmtime(path)
+                if mtime + self._ttl_seconds < now:
+                    os.remove(path)
+                else:
+                    paths.append((mtime, path))
+            except OSError:
+                pass
+        paths.sort()
+        for _, path in paths[: max(0, len(paths) - self._disk_max_entries)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _log_stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        if lookups % _STATS_LOG_INTERVAL == 0:
+            stats = self.stats()
+            print(
+                f"Response cache hit rate {stats['hit_rate']:.0%} (hits={stats['hits']}, disk_hits={stats['disk_hits']}, misses={stats['misses']}, entries={stats['entries']})"
+            )
+
+    async def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        value = None
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > now:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            value = entry[1]
+        elif self._disk_dir:
+            entry = await asyncio.to_thread(self._read_disk, key)
+            if entry is not None and entry[0] > now:
+                self._remember(key, *entry)
+                self.disk_hits += 1
+                value = entry[1]
+        if value is None:
+            self.misses += 1
+        self._log_stats()
+        return value
+
+    async def put(self, key: str, value: str):
+        expires_at = time.time() + self._ttl_seconds
+        self._remember(key, expires_at, value)
+        if not self._disk_dir:
+            return
+        try:
+            await asyncio.to_thread(self._write_disk, key, expires_at, value)
+            self._disk_writes += 1
+            if self._disk_writes % _STATS_LOG_INTERVAL == 0:
+                await asyncio.to_thread(self._prune_disk)
+        except OSError as e:
+            print(f"Failed to write response cache entry: {e}")
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+        }
+
+
+response_cache = ResponseCache(
+    RESPONSE_CACHE_MAX_ENTRIES,
+    RESPONSE_CACHE_MAX_BYTES,
+    RESPONSE_CACHE_TTL_SECONDS,
+    disk_dir=RESPONSE_CACHE_DISK_DIR or None,
+    disk_max_entries=RESPONSE_CACHE_DISK_MAX_ENTRIES,
+)
@@ -0,0 +1,67 @@
+"""prepared sandbox pool state
+
+Revision ID: 7b1f3d6e2a54
+Revises: 4c2e8a91f7b3
+Create Date: 2026-10-17 16:41:09.524317
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "7b1f3d6e2a54"
+down_revision: Union[str, None] = "4c2e8a91f7b3"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Create the enum type first
+    status_enum = sa.Enum("PREPARING", "READY", name="preparedsandboxstatus")
+    status_enum.create(op.get_bind())
+
+    # Existing rows are all prepared sandboxes
+    op.add_column(
+        "prepared_sandboxes",
+        sa.Column("status", status_enum, nullable=False, server_default="READY"),
+    )
+    op.create_table(
+        "prepared_sandbox_claims",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("project_id", sa.Integer(), nullable=False),
+        sa.Column("stack_id", sa.Integer(), nullable=False),
+        sa.Column("hit", sa.Boolean(), nullable=False),
+        sa.Column(
+            "created_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.Column("updated_at", sa.DateTime(timezone=True), nullable=True),
+        sa.ForeignKeyConstraint(["project_id"], ["projects.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["stack_id"], ["stacks.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("project_id"),
+    )
+    op.create_index(
+        op.f("ix_prepared_sandbox_claims_id"),
+        "prepared_sandbox_claims",
+        ["id"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    # Drop the table and column first
+    op.drop_index(
+        op.f("ix_prepared_sandbox_claims_id"), table_name="prepared_sandbox_claims"
+    )
+    op.drop_table("prepared_sandbox_claims")
+    op.drop_column("prepared_sandboxes", "status")
+
+    # Drop the enum type
+    status_enum = sa.Enum(name="preparedsandboxstatus")
+    status_enum.drop(op.get_bind())
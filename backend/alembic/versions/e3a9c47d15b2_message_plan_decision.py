@@ -0,0 +1,28 @@
+"""message plan decision
+
+Revision ID: e3a9c47d15b2
+Revises: 7b1f3d6e2a54
+Create Date: 2026-10-17 17:28:51.093674
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "e3a9c47d15b2"
+down_revision: Union[str, None] = "7b1f3d6e2a54"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("messages", sa.Column("planned", sa.Boolean(), nullable=True))
+    op.add_column("messages", sa.Column("plan_reason", sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("messages", "plan_reason")
+    op.drop_column("messages", "planned")
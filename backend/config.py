@@ -43,6 +43,24 @@ UNSPLASH_ACCESS_KEY = os.getenv("UNSPLASH_ACCESS_KEY")
 MODAL_TOKEN_ID = os.getenv("MODAL_TOKEN_ID")
 MODAL_TOKEN_SECRET = os.getenv("MODAL_TOKEN_SECRET")
 MODAL_APP_NAME = os.getenv("MODAL_APP_NAME", "prompt-stack-sandbox")
+FILE_INDEX_LISTDIR_CONCURRENCY = _int_env("FILE_INDEX_LISTDIR_CONCURRENCY", 16)
+SANDBOX_FILE_CACHE_MAX_BYTES = _int_env(
+    "SANDBOX_FILE_CACHE_MAX_BYTES", 64 * 1024 * 1024
+)
+SANDBOX_FILE_CACHE_MAX_ENTRIES = _int_env("SANDBOX_FILE_CACHE_MAX_ENTRIES", 50_000)
+DEV_SERVER_LOG_MAX_LINES = _int_env("DEV_SERVER_LOG_MAX_LINES", 1000)
+DEV_SERVER_COMPILE_WAIT_SECONDS = _int_env("DEV_SERVER_COMPILE_WAIT_SECONDS", 10)
+SANDBOX_BOOT_DEADLINE_SECONDS = _int_env("SANDBOX_BOOT_DEADLINE_SECONDS", 60 * 10)
+HEALTH_CHECK_TIMEOUT_SECONDS = _int_env("HEALTH_CHECK_TIMEOUT_SECONDS", 10)
+HEALTH_CHECK_MAX_CONNECTIONS = _int_env("HEALTH_CHECK_MAX_CONNECTIONS", 50)
+HEALTH_CHECK_INTERVAL_SECONDS = _int_env("HEALTH_CHECK_INTERVAL_SECONDS", 30)
+HEALTH_CHECK_FAILURE_THRESHOLD = _int_env("HEALTH_CHECK_FAILURE_THRESHOLD", 1)
+SANDBOX_DAEMON_ENABLED = _bool_env("SANDBOX_DAEMON_ENABLED", default=True)
+LINT_SERVER_ENABLED = _bool_env("LINT_SERVER_ENABLED", default=True)
+LINT_REPAIR_MAX_ATTEMPTS = _int_env("LINT_REPAIR_MAX_ATTEMPTS", 2)
+SANDBOX_DAEMON_IDLE_TIMEOUT_SECONDS = _int_env(
+    "SANDBOX_DAEMON_IDLE_TIMEOUT_SECONDS", 60 * 10
+)
 
 # AI configuration
 OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")
@@ -53,13 +71,44 @@ FAST_PROVIDER = _enum_env("FAST_PROVIDER", ["openai", "anthropic"], default="ant
 MAIN_PROVIDER = _enum_env("MAIN_PROVIDER", ["openai", "anthropic"], default="anthropic")
 FAST_MODEL = os.getenv("FAST_MODEL", "claude-3-5-haiku-20241022")
 MAIN_MODEL = os.getenv("MAIN_MODEL", "claude-3-7-sonnet-20250219")
+LLM_HTTP_MAX_CONNECTIONS = _int_env("LLM_HTTP_MAX_CONNECTIONS", 100)
+LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS = _int_env("LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS", 20)
+SHELL_TOOL_TIMEOUT_SECONDS = _int_env("SHELL_TOOL_TIMEOUT_SECONDS", 120)
+SHELL_TOOL_MAX_OUTPUT_CHARS = _int_env("SHELL_TOOL_MAX_OUTPUT_CHARS", 20_000)
+CONTEXT_MAX_TOKENS = _int_env("CONTEXT_MAX_TOKENS", 50_000)
+CONTEXT_RECENT_MESSAGES = _int_env("CONTEXT_RECENT_MESSAGES", 6)
+CONTEXT_IMAGE_MESSAGES = _int_env("CONTEXT_IMAGE_MESSAGES", 2)
+CONTEXT_SUMMARY_MIN_TOKENS = _int_env("CONTEXT_SUMMARY_MIN_TOKENS", 300)
+CONTEXT_FOLLOW_UP_MAX_TOKENS = _int_env("CONTEXT_FOLLOW_UP_MAX_TOKENS", 4000)
+PLANNING_MODE = _enum_env("PLANNING_MODE", ["auto", "always"], default="auto")
+RESPONSE_CACHE_MAX_ENTRIES = _int_env("RESPONSE_CACHE_MAX_ENTRIES", 1000)
+RESPONSE_CACHE_MAX_BYTES = _int_env("RESPONSE_CACHE_MAX_BYTES", 32 * 1024 * 1024)
+RESPONSE_CACHE_TTL_SECONDS = _int_env("RESPONSE_CACHE_TTL_SECONDS", 60 * 60)
+RESPONSE_CACHE_DISK_DIR = os.getenv("RESPONSE_CACHE_DISK_DIR", "")
+RESPONSE_CACHE_DISK_MAX_ENTRIES = _int_env("RESPONSE_CACHE_DISK_MAX_ENTRIES", 10_000)
 
 # Misc configuration
 RUN_PERIODIC_CLEANUP = _bool_env("RUN_PERIODIC_CLEANUP", default=True)
 RUN_STACK_SYNC_ON_START = _bool_env("RUN_STACK_SYNC_ON_START", default=True)
 PROJECTS_SET_NEVER_CLEANUP = _bool_env("PROJECTS_SET_NEVER_CLEANUP", default=False)
 PROJECT_RESOURCE_TIMEOUT_SECONDS = _int_env("PROJECT_RESOURCE_TIMEOUT_SECONDS", 60 * 30)
-TARGET_PREPARED_SANDBOXES_PER_STACK = _int_env("TARGET_PREPARED_SANDBOXES_PER_STACK", 3)
+PREPARED_SANDBOX_POOL_MIN = _int_env("PREPARED_SANDBOX_POOL_MIN", 1)
+PREPARED_SANDBOX_POOL_MAX = _int_env("PREPARED_SANDBOX_POOL_MAX", 10)
+PREPARED_SANDBOX_DEMAND_WINDOW_SECONDS = _int_env(
+    "PREPARED_SANDBOX_DEMAND_WINDOW_SECONDS", 60 * 15
+)
+PREPARED_SANDBOX_MAX_CONCURRENT_PREPARES = _int_env(
+    "PREPARED_SANDBOX_MAX_CONCURRENT_PREPARES", 4
+)
+BROWSER_POOL_SIZE = _int_env("BROWSER_POOL_SIZE", 4)
+BROWSER_LEASE_TIMEOUT_SECONDS = _int_env("BROWSER_LEASE_TIMEOUT_SECONDS", 30)
+BROWSER_READINESS_MODE = _enum_env(
+    "BROWSER_READINESS_MODE", ["adaptive", "fixed"], default="adaptive"
+)
+BROWSER_SETTLE_WINDOW_MS = _int_env("BROWSER_SETTLE_WINDOW_MS", 500)
+CHAT_CHUNK_COALESCE_MS = _int_env("CHAT_CHUNK_COALESCE_MS", 30)
+CHAT_CHUNK_COALESCE_BYTES = _int_env("CHAT_CHUNK_COALESCE_BYTES", 2048)
+WEBSOCKET_MAX_PENDING_FRAMES = _int_env("WEBSOCKET_MAX_PENDING_FRAMES", 256)
 FRONTEND_URL = os.getenv("FRONTEND_URL", "https://sparkstack.app")
 
 # Credits configuration
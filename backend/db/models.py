@@ -181,6 +181,11 @@ class Message(TimestampMixin, Base):
     role = Column(String, nullable=False)
     content = Column(Text, nullable=False)
     images = Column(ARRAY(String), nullable=True)
+    # Condensed content used in place of older messages in model context
+    summary = Column(Text, nullable=True)
+    # Whether the agent planned before this (assistant) reply and why
+    planned = Column(Boolean, nullable=True)
+    plan_reason = Column(String, nullable=True)
 
     chat_id = Column(
         Integer, ForeignKey("chats.id", ondelete="CASCADE"), nullable=False
@@ -188,6 +193,11 @@ class Message(TimestampMixin, Base):
     chat = relationship("Chat", back_populates="messages")
 
 
+class PreparedSandboxStatus(PyEnum):
+    PREPARING = "preparing"
+    READY = "ready"
+
+
 class PreparedSandbox(TimestampMixin, Base):
     __tablename__ = "prepared_sandboxes"
 
@@ -195,11 +205,34 @@ class PreparedSandbox(TimestampMixin, Base):
     modal_sandbox_id = Column(String, nullable=True)
     modal_volume_label = Column(String, nullable=True)
     pack_hash = Column(String, nullable=True)
+    # PREPARING rows are placeholders for prepares in flight on some worker
+    status = Column(
+        Enum(PreparedSandboxStatus),
+        nullable=False,
+        default=PreparedSandboxStatus.READY,
+    )
 
     stack_id = Column(Integer, ForeignKey("stacks.id"), nullable=False)
     stack = relationship("Stack", back_populates="prepared_sandboxes")
 
 
+class PreparedSandboxClaim(TimestampMixin, Base):
+    __tablename__ = "prepared_sandbox_claims"
+
+    id = Column(Integer, primary_key=True, index=True)
+    project_id = Column(
+        Integer,
+        ForeignKey("projects.id", ondelete="CASCADE"),
+        nullable=False,
+        unique=True,
+    )
+    stack_id = Column(
+        Integer, ForeignKey("stacks.id", ondelete="CASCADE"), nullable=False
+    )
+    # Whether the project got a prepared sandbox or had to wait for a new one
+    hit = Column(Boolean, nullable=False)
+
+
 class TeamInvite(TimestampMixin, Base):
     __tablename__ = "team_invites"
 
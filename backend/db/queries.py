@@ -1,10 +1,20 @@
-from typing import Optional
+from typing import List, Optional
 
 from sqlalchemy.orm import joinedload
 from sqlalchemy.orm import Session
-from sqlalchemy import and_
+from sqlalchemy import and_, delete, select, update
+from sqlalchemy.dialects.postgresql import insert
 
-from db.models import Chat, User, Project, Team, TeamMember
+from db.models import (
+    Chat,
+    User,
+    Project,
+    Team,
+    TeamMember,
+    PreparedSandbox,
+    PreparedSandboxClaim,
+    PreparedSandboxStatus,
+)
 
 
 def get_chat_for_user(db: Session, chat_id: int, current_user: User) -> Optional[Chat]:
@@ -35,3 +45,74 @@ def get_project_for_user(
         .first()
     )
     return project
+
+
+def _delete_prepared_sandboxes(db: Session, stack_id: int, limit: int) -> List[str]:
+    # Rows locked by a concurrent claim are skipped rather than waited on
+    ids = (
+        select(PreparedSandbox.id)
+        .where(
+            PreparedSandbox.stack_id == stack_id,
+            PreparedSandbox.status == PreparedSandboxStatus.READY,
+        )
+        .order_by(PreparedSandbox.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    return list(
+        db.execute(
+            delete(PreparedSandbox)
+            .where(PreparedSandbox.id.in_(ids.scalar_subquery()))
+            .returning(PreparedSandbox.modal_volume_label)
+            .execution_options(synchronize_session=False)
+        ).scalars()
+    )
+
+
+def claim_prepared_sandbox(
+    db: Session, stack_id: int, project_id: int
+) -> Optional[str]:
+    """
+    Atomically move a prepared sandbox of the stack to the project, returning its volume label.
+
+    The row is picked with FOR UPDATE SKIP LOCKED and deleted in the same statement, so
+    concurrent claims (from any process) never get the same volume. The project is only
+    updated if it doesn't have a volume yet, otherwise the claim is rolled back.
+    """
+    vol_labels = _delete_prepared_sandboxes(db, stack_id, limit=1)
+    if not vol_labels:
+        db.rollback()
+        return None
+    vol_label = vol_labels[0]
+    updated = db.execute(
+        update(Project)
+        .where(Project.id == project_id, Project.modal_volume_label.is_(None))
+        .values(modal_volume_label=vol_label)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if updated == 0:
+        db.rollback()
+        return None
+    db.commit()
+    return vol_label
+
+
+def release_prepared_sandboxes(db: Session, stack_id: int, limit: int) -> List[str]:
+    """
+    Remove up to `limit` unclaimed prepared sandboxes of the stack, returning their volume labels.
+
+    Doesn't commit, so the caller can make it part of a larger transaction.
+    """
+    return _delete_prepared_sandboxes(db, stack_id, limit)
+
+
+def record_prepared_sandbox_claim(
+    db: Session, project_id: int, stack_id: int, hit: bool
+):
+    """Record whether the project found a prepared sandbox, once per project."""
+    db.execute(
+        insert(PreparedSandboxClaim)
+        .values(project_id=project_id, stack_id=stack_id, hit=hit)
+        .on_conflict_do_nothing(index_elements=["project_id"])
+    )
+    db.commit()
@@ -17,6 +17,8 @@ from routers import (
     stripe,
 )
 from config import RUN_PERIODIC_CLEANUP
+from agents.providers import close_llm_providers
+from sandbox.health import close_health_session
 
 from tasks.tasks import (
     cleanup_inactive_project_managers,
@@ -43,6 +45,8 @@ async def lifespan(app: FastAPI):
     task = asyncio.create_task(periodic_task())
     yield
     task.cancel()
+    await close_llm_providers()
+    await close_health_session()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -1,8 +1,9 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Tuple
 from sqlalchemy.orm import joinedload
 import secrets
+import asyncio
 from datetime import datetime, timezone
 
 from db.database import get_db
@@ -18,6 +19,7 @@ from db.models import (
 from db.queries import get_chat_for_user
 from agents.prompts import name_chat, pick_stack
 from sandbox.sandbox import DevSandbox
+from routers.project_socket import get_or_start_project_manager
 from config import (
     CREDITS_CHAT_COST,
     CREDIT_MAX_CHATS_FOR_SHARED_POOL,
@@ -63,19 +65,31 @@ async def get_chat(
 
 
 async def _pick_stack(db: Session, seed_prompt: str) -> Stack:
-    if "p5" in seed_prompt.lower():
-        title = "p5.js"
-    elif "pixi" in seed_prompt.lower():
-        title = "Pixi.js"
-    else:
-        title = await pick_stack(
-            seed_prompt,
-            [s.title for s in db.query(Stack).all()],
-            default="Next.js Shadcn",
-        )
+    title = await pick_stack(
+        seed_prompt,
+        [s.title for s in db.query(Stack).all()],
+        default="Next.js Shadcn",
+    )
     return db.query(Stack).filter(Stack.title == title).first()
 
 
+def _provisional_name(seed_prompt: str) -> str:
+    name = " ".join(seed_prompt.split()[:6])
+    return name[:60] or "New Project"
+
+
+async def _await_names(
+    name_task: "asyncio.Task[Tuple[str, str, str]]", seed_prompt: str
+) -> Tuple[str, str, str]:
+    """The (project, description, chat) names, provisional ones if naming failed."""
+    try:
+        return await name_task
+    except Exception as e:
+        # Credits are spent by now, a naming hiccup shouldn't fail the request
+        print(f"Error naming chat, using provisional names: {e}")
+        return _provisional_name(seed_prompt), "", "New Chat"
+
+
 async def _check_and_deduct_credits(
     db: Session, team: Team, cost: int, user: User
 ) -> None:
@@ -143,41 +157,63 @@ async def create_chat(
         raise HTTPException(status_code=404, detail="Team not found")
     team_id = team.id
 
-    if chat.stack_id is None:
-        stack = await _pick_stack(db, chat.seed_prompt)
-    else:
-        stack = db.query(Stack).filter(Stack.id == chat.stack_id).first()
-        if stack is None:
-            raise HTTPException(status_code=404, detail="Stack not found")
-
-    project_name, project_description, chat_name = await name_chat(chat.seed_prompt)
-
-    if chat.project_id is None:
-        project = Project(
-            name=project_name,
-            description=project_description,
-            custom_instructions="",
-            user_id=current_user.id,
-            team_id=team_id,
-            stack_id=stack.id,
-            modal_never_cleanup=PROJECTS_SET_NEVER_CLEANUP,
-        )
-        db.add(project)
-        db.commit()
-        db.refresh(project)
-        project_id = project.id
-    else:
-        project = (
-            db.query(Project)
-            .filter(
-                Project.id == chat.project_id,
-                ((Project.user_id == current_user.id) | (Project.team_id == team_id)),
+    # Before any work, a team out of credits shouldn't get a project or a sandbox. The
+    # deduction is committed with the project (or the chat for an existing project).
+    await _check_and_deduct_credits(db, team, CREDITS_CHAT_COST, current_user)
+
+    # Naming doesn't depend on the stack, let it run while the stack is picked
+    name_task = asyncio.create_task(name_chat(chat.seed_prompt))
+    try:
+        if chat.project_id is None:
+            if chat.stack_id is None:
+                stack = await _pick_stack(db, chat.seed_prompt)
+            else:
+                stack = db.query(Stack).filter(Stack.id == chat.stack_id).first()
+                if stack is None:
+                    raise HTTPException(status_code=404, detail="Stack not found")
+
+            # Created before naming is done so the sandbox can boot meanwhile
+            project = Project(
+                name=_provisional_name(chat.seed_prompt),
+                description="",
+                custom_instructions="",
+                user_id=current_user.id,
+                team_id=team_id,
+                stack_id=stack.id,
+                modal_never_cleanup=PROJECTS_SET_NEVER_CLEANUP,
             )
-            .first()
-        )
-        if project is None:
-            raise HTTPException(status_code=404, detail="Project not found")
-        project_id = project.id
+            db.add(project)
+            db.commit()
+            db.refresh(project)
+            project_id = project.id
+            get_or_start_project_manager(project_id)
+
+            project_name, project_description, chat_name = await _await_names(
+                name_task, chat.seed_prompt
+            )
+            project.name = project_name
+            project.description = project_description
+            db.commit()
+        else:
+            project = (
+                db.query(Project)
+                .filter(
+                    Project.id == chat.project_id,
+                    (
+                        (Project.user_id == current_user.id)
+                        | (Project.team_id == team_id)
+                    ),
+                )
+                .first()
+            )
+            if project is None:
+                raise HTTPException(status_code=404, detail="Project not found")
+            project_id = project.id
+            get_or_start_project_manager(project_id)
+
+            _, _, chat_name = await _await_names(name_task, chat.seed_prompt)
+    finally:
+        name_task.cancel()
 
     new_chat = Chat(
         name=chat_name,
@@ -185,8 +221,6 @@ async def create_chat(
         user_id=current_user.id,
     )
 
-    await _check_and_deduct_credits(db, team, CREDITS_CHAT_COST, current_user)
-
     try:
         db.add(new_chat)
         db.commit()
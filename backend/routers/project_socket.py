@@ -1,19 +1,28 @@
 from fastapi import APIRouter, WebSocket, WebSocketException, WebSocketDisconnect
-from typing import Dict, List, Optional
+from typing import Callable, Deque, Dict, List, Optional
+from collections import deque
 from enum import Enum
 from asyncio import create_task, Lock
 from pydantic import BaseModel
 import datetime
 import asyncio
+import json
 import traceback
 
 from sandbox.sandbox import DevSandbox, SandboxNotReadyException
+from sandbox.health import health_prober
 from agents.agent import Agent, ChatMessage
+from agents.context import summarize_older_messages
 from db.database import get_db
 from db.models import Project, Message as DbChatMessage, Stack, User, Chat
 from db.queries import get_chat_for_user
 from routers.auth import get_current_user_from_token
 from sqlalchemy.orm import Session
+from config import (
+    CHAT_CHUNK_COALESCE_MS,
+    CHAT_CHUNK_COALESCE_BYTES,
+    WEBSOCKET_MAX_PENDING_FRAMES,
+)
 
 
 class SandboxStatus(str, Enum):
@@ -28,12 +37,62 @@ class SandboxStatus(str, Enum):
 class ProjectStatusResponse(BaseModel):
     for_type: str = "status"
     project_id: int
+    seq: int = 0
     sandbox_status: SandboxStatus
     tunnels: Dict[int, str]
     file_paths: Optional[List[str]] = None
     git_log: Optional[str] = None
 
 
+class ProjectStatusDeltaResponse(BaseModel):
+    """Changes since the status with `seq - 1`, clients that missed one ask for a resync."""
+
+    for_type: str = "status_delta"
+    project_id: int
+    seq: int
+    sandbox_status: SandboxStatus
+    tunnels: Optional[Dict[int, str]] = None  # Only when changed
+    added_file_paths: List[str] = []
+    removed_file_paths: List[str] = []
+    new_git_log_lines: List[str] = []  # Newest first, to prepend to the log
+    git_log: Optional[str] = (
+        None  # Whole log, only when it can't be expressed as new lines
+    )
+
+
+def _status_delta(
+    prev: ProjectStatusResponse, cur: ProjectStatusResponse
+) -> Optional[ProjectStatusDeltaResponse]:
+    """Compute the delta between two status snapshots, None when nothing changed."""
+    prev_paths = set(prev.file_paths or [])
+    cur_paths = set(cur.file_paths or [])
+    delta = ProjectStatusDeltaResponse(
+        project_id=cur.project_id,
+        seq=cur.seq,
+        sandbox_status=cur.sandbox_status,
+        tunnels=cur.tunnels if cur.tunnels != prev.tunnels else None,
+        added_file_paths=sorted(cur_paths - prev_paths),
+        removed_file_paths=sorted(prev_paths - cur_paths),
+    )
+    if (cur.git_log or "") != (prev.git_log or ""):
+        prev_lines = (prev.git_log or "").splitlines()
+        cur_lines = (cur.git_log or "").splitlines()
+        if prev_lines and prev_lines[0] in cur_lines:
+            delta.new_git_log_lines = cur_lines[: cur_lines.index(prev_lines[0])]
+        else:
+            delta.git_log = cur.git_log or ""
+    if (
+        delta.sandbox_status == prev.sandbox_status
+        and delta.tunnels is None
+        and not delta.added_file_paths
+        and not delta.removed_file_paths
+        and not delta.new_git_log_lines
+        and delta.git_log is None
+    ):
+        return None
+    return delta
+
+
 class ChatUpdateResponse(BaseModel):
     for_type: str = "chat_update"
     chat_id: int
@@ -42,6 +101,12 @@ class ChatUpdateResponse(BaseModel):
     navigate_to: Optional[str] = None
 
 
+class ChatFollowUpsResponse(BaseModel):
+    for_type: str = "follow_ups"
+    chat_id: int
+    follow_ups: List[str]
+
+
 class ChatChunkResponse(BaseModel):
     for_type: str = "chat_chunk"
     role: str
@@ -64,9 +129,150 @@ def _db_message_to_message(db_message: DbChatMessage) -> ChatMessage:
         role=db_message.role,
         content=db_message.content,
         images=db_message.images,
+        summary=db_message.summary,
+    )
+
+
+class _Frame:
+    """An outbound message, serialized at most once no matter how many sockets it goes to."""
+
+    def __init__(self, data: BaseModel):
+        self.data = data
+        self._text: Optional[str] = None
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = self.data.model_dump_json()
+        return self._text
+
+
+def _merge_chunk_frames(a: _Frame, b: _Frame) -> Optional[_Frame]:
+    if not (
+        isinstance(a.data, ChatChunkResponse)
+        and isinstance(b.data, ChatChunkResponse)
+        and a.data.role == b.data.role
+    ):
+        return None
+    return _Frame(
+        ChatChunkResponse(
+            role=a.data.role,
+            content=a.data.content + b.data.content,
+            thinking_content=a.data.thinking_content + b.data.thinking_content,
+        )
     )
 
 
+class _SocketWriter:
+    """
+    Sends frames to a single socket from its own task, so a slow client never blocks the
+    agent loop. While the socket is behind, queued chunks are merged into one frame.
+    """
+
+    def __init__(self, socket: WebSocket, on_error: Callable[[], None]):
+        self.socket = socket
+        self._on_error = on_error
+        self._pending: Deque[_Frame] = deque()
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._task = create_task(self._run())
+
+    def send(self, frame: _Frame):
+        merged = (
+            _merge_chunk_frames(self._pending[-1], frame) if self._pending else None
+        )
+        if merged is not None:
+            self._pending[-1] = merged
+        else:
+            self._pending.append(frame)
+        self._idle.clear()
+        if len(self._pending) > WEBSOCKET_MAX_PENDING_FRAMES:
+            print("Dropping websocket that is too far behind")
+            self.close()
+            self._on_error()
+            # Closing makes the client reconnect and start over from a fresh snapshot
+            create_task(self._close_socket())
+            return
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            while not self._pending:
+                self._idle.set()
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            frame = self._pending.popleft()
+            try:
+                await self.socket.send_text(frame.text)
+            except Exception:
+                self._pending.clear()
+                self._on_error()
+                return
+
+    async def drain(self, timeout: float):
+        """Wait (up to `timeout` seconds) for everything queued so far to be sent."""
+        if self._task.done():
+            return
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def close(self):
+        self._pending.clear()
+        self._idle.set()
+        self._task.cancel()
+
+    async def _close_socket(self):
+        try:
+            await self.socket.close(code=1013)
+        except Exception:
+            pass
+
+
+class _ChunkCoalescer:
+    """Buffers a chat's streamed chunks and hands them on in batches by time or size."""
+
+    def __init__(self, on_flush: Callable[[ChatChunkResponse], None]):
+        self._on_flush = on_flush
+        self._role: Optional[str] = None
+        self._content: List[str] = []
+        self._thinking_content: List[str] = []
+        self._size = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def add(self, chunk: ChatChunkResponse):
+        if self._role is not None and chunk.role != self._role:
+            self.flush()
+        self._role = chunk.role
+        self._content.append(chunk.content)
+        self._thinking_content.append(chunk.thinking_content)
+        self._size += len(chunk.content) + len(chunk.thinking_content)
+        if self._size >= CHAT_CHUNK_COALESCE_BYTES:
+            self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_event_loop().call_later(
+                CHAT_CHUNK_COALESCE_MS / 1000, self.flush
+            )
+
+    def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._role is None:
+            return
+        chunk = ChatChunkResponse(
+            role=self._role,
+            content="".join(self._content),
+            thinking_content="".join(self._thinking_content),
+        )
+        self._role = None
+        self._content = []
+        self._thinking_content = []
+        self._size = 0
+        self._on_flush(chunk)
+
+
 router = APIRouter(tags=["websockets"])
 
 
@@ -75,14 +281,19 @@ class ProjectManager:
         self.db = db
         self.project_id = project_id
         self.chat_sockets: Dict[int, List[WebSocket]] = {}
+        self.socket_writers: Dict[int, _SocketWriter] = {}  # by id(socket)
+        self.chat_coalescers: Dict[int, _ChunkCoalescer] = {}
         self.chat_agents: Dict[int, Agent] = {}
         self.chat_users: Dict[int, User] = {}
+        self.follow_up_tasks: Dict[int, asyncio.Task] = {}
         self.lock: Lock = Lock()
         self.sandbox_status = SandboxStatus.OFFLINE
         self.sandbox = None
         self.sandbox_file_paths: Optional[List[str]] = None
         self.sandbox_git_log: Optional[str] = None
         self.tunnels = {}
+        self.status_seq = 0
+        self._last_status: Optional[ProjectStatusResponse] = None
         self.last_activity = datetime.datetime.now()
         self.killed = False
 
@@ -97,12 +308,16 @@ class ProjectManager:
             return
         self.killed = True
         self.sandbox_status = SandboxStatus.BUILDING
-        await self.emit_project(await self._get_project_status())
+        await self.emit_project_status()
 
-        # Close all websockets
+        # Let queued messages (like the status above) go out, then close all websockets
+        await asyncio.gather(
+            *[writer.drain(timeout=5) for writer in self.socket_writers.values()]
+        )
         close_tasks = []
         for sockets in self.chat_sockets.values():
             for socket in sockets:
+                self._close_writer(socket)
                 try:
                     close_tasks.append(socket.close())
                 except Exception:
@@ -111,23 +326,30 @@ class ProjectManager:
             await asyncio.gather(*close_tasks)
 
         # Clear socket and agent dictionaries
+        for task in self.follow_up_tasks.values():
+            task.cancel()
+        self.follow_up_tasks.clear()
         self.chat_sockets.clear()
+        self.chat_coalescers.clear()
         self.chat_agents.clear()
         self.chat_users.clear()
+        if self.sandbox is not None:
+            self.sandbox.logs.close()
         project = self.db.query(Project).filter(Project.id == self.project_id).first()
         if project and project.modal_volume_label:
             await DevSandbox.terminate_project_resources(project)
+        self.db.close()
 
     async def _manage_sandbox_task(self):
         print(f"Managing sandbox for project {self.project_id}...")
         self.sandbox_status = SandboxStatus.BUILDING
-        await self.emit_project(await self._get_project_status())
+        await self.emit_project_status()
         while self.sandbox is None:
             try:
                 self.sandbox = await DevSandbox.get_or_create(self.project_id)
             except SandboxNotReadyException:
                 self.sandbox_status = SandboxStatus.BUILDING_WAITING
-                await self.emit_project(await self._get_project_status())
+                await self.emit_project_status()
                 await asyncio.sleep(10)
         await self.sandbox.wait_for_up()
         self.sandbox_status = SandboxStatus.READY
@@ -137,13 +359,23 @@ class ProjectManager:
             self.sandbox.get_file_paths(),
             self.sandbox.read_file_contents("/app/git.log", does_not_exist_ok=True),
         )
-        await self.emit_project(await self._get_project_status())
+        await self.emit_project_status()
         for agent in self.chat_agents.values():
             agent.set_sandbox(self.sandbox)
             agent.set_app_temp_url(self.tunnels[3000])
 
-        while await self.sandbox.is_up():
-            await asyncio.sleep(30)
+        down_task = create_task(health_prober.wait_until_down(self.tunnels[3000]))
+        exited_task = create_task(self.sandbox.logs.exited.wait())
+        try:
+            done, _ = await asyncio.wait(
+                {down_task, exited_task}, return_when=asyncio.FIRST_COMPLETED
+            )
+            # The dev server's output ended, unless it's somehow still serving stop now
+            if down_task not in done and await self.sandbox.is_up():
+                await down_task
+        finally:
+            down_task.cancel()
+            exited_task.cancel()
         await self.kill()
 
     async def _try_manage_sandbox(self):
@@ -161,6 +393,7 @@ class ProjectManager:
     async def _get_project_status(self):
         return ProjectStatusResponse(
             project_id=self.project_id,
+            seq=self.status_seq,
             sandbox_status=self.sandbox_status,
             tunnels=self.tunnels,
             file_paths=self.sandbox_file_paths,
@@ -181,22 +414,67 @@ class ProjectManager:
             self.chat_agents[chat_id] = agent
             self.chat_sockets[chat_id] = []
             self.chat_users[chat_id] = user
+            self.chat_coalescers[chat_id] = _ChunkCoalescer(
+                lambda chunk: self._send_frame(chat_id, _Frame(chunk))
+            )
         self.chat_sockets[chat_id].append(websocket)
-        await self.emit_project(await self._get_project_status())
+        self.socket_writers[id(websocket)] = _SocketWriter(
+            websocket, lambda: self._drop_socket(chat_id, websocket)
+        )
+        await self.send_status_snapshot(websocket)
+
+    async def emit_project_status(self):
+        """Broadcast what changed in the project status since the last emit."""
+        status = await self._get_project_status()
+        if self._last_status is None:
+            self._last_status = status
+            await self.emit_project(status)
+            return
+        status.seq = self.status_seq + 1
+        delta = _status_delta(self._last_status, status)
+        if delta is None:
+            return
+        self.status_seq = status.seq
+        self._last_status = status
+        await self.emit_project(delta)
+
+    async def send_status_snapshot(self, websocket: WebSocket):
+        """Send the full status to a single socket, on join or when it asks to resync."""
+        # Broadcast anything pending first so the snapshot matches its sequence number
+        await self.emit_project_status()
+        if writer := self.socket_writers.get(id(websocket)):
+            writer.send(_Frame(self._last_status))
+
+    def _close_writer(self, websocket: WebSocket):
+        writer = self.socket_writers.pop(id(websocket), None)
+        if writer is not None:
+            writer.close()
+
+    def _drop_socket(self, chat_id: int, websocket: WebSocket):
+        self._close_writer(websocket)
+        try:
+            self.chat_sockets[chat_id].remove(websocket)
+        except (KeyError, ValueError):
+            pass
 
     def remove_chat_socket(self, chat_id: int, websocket: WebSocket):
+        self._close_writer(websocket)
         try:
             self.chat_sockets[chat_id].remove(websocket)
-        except ValueError:
+        except (KeyError, ValueError):
             pass
-        if len(self.chat_sockets[chat_id]) == 0:
+        if chat_id in self.chat_sockets and len(self.chat_sockets[chat_id]) == 0:
             del self.chat_sockets[chat_id]
             del self.chat_agents[chat_id]
             del self.chat_users[chat_id]
+            self.chat_coalescers.pop(chat_id).flush()
 
     async def _handle_chat_message(self, chat_id: int, message: ChatMessage):
+        # Suggestions for the previous reply are stale now
+        if task := self.follow_up_tasks.pop(chat_id, None):
+            task.cancel()
         self.sandbox_status = SandboxStatus.WORKING
-        await self.emit_project(await self._get_project_status())
+        await self.emit_project_status()
 
         db_message = _message_to_db_message(message, chat_id)
         self.db.add(db_message)
@@ -230,33 +508,55 @@ class ProjectManager:
                     content=partial_message.delta_content,
                     thinking_content=partial_message.delta_thinking_content,
                 ),
+                # Tool calls are shown right away rather than with the next batch
+                flush=not partial_message.persist,
             )
+        self.flush_chat(chat_id)
 
         resp_message = ChatMessage(role="assistant", content=total_content)
+        # Follow-ups are only suggestions, they arrive whenever they're ready
+        self.follow_up_tasks[chat_id] = create_task(
+            self._emit_follow_ups(chat_id, agent, messages + [resp_message])
+        )
+
         db_resp_message = _message_to_db_message(resp_message, chat_id)
+        db_resp_message.planned = agent.plan_needed
+        db_resp_message.plan_reason = agent.plan_reason
         project = self.db.query(Project).filter(Project.id == self.project_id).first()
         project.modal_sandbox_last_used_at = datetime.datetime.now()
         self.db.add(db_resp_message)
         self.db.commit()
 
-        follow_ups = await agent.suggest_follow_ups(messages + [resp_message])
-
         await self.emit_chat(
             chat_id,
             ChatUpdateResponse(
                 chat_id=chat_id,
                 message=_db_message_to_message(db_resp_message),
-                follow_ups=follow_ups,
                 navigate_to=agent.working_page,
             ),
         )
 
+        # Ready for the next turn before it needs them
+        create_task(summarize_older_messages(chat_id))
+
         self.sandbox_status = SandboxStatus.READY
         self.sandbox_file_paths, self.sandbox_git_log = await asyncio.gather(
             self.sandbox.get_file_paths(),
             self.sandbox.read_file_contents("/app/git.log", does_not_exist_ok=True),
         )
-        await self.emit_project(await self._get_project_status())
+        await self.emit_project_status()
+
+    async def _emit_follow_ups(
+        self, chat_id: int, agent: Agent, messages: List[ChatMessage]
+    ):
+        try:
+            follow_ups = await agent.suggest_follow_ups(messages)
+        except Exception as e:
+            print(f"Error suggesting follow ups: {e}")
+            return
+        await self.emit_chat(
+            chat_id, ChatFollowUpsResponse(chat_id=chat_id, follow_ups=follow_ups)
+        )
 
     async def _try_handle_chat_message(self, chat_id: int, message: ChatMessage):
         try:
@@ -266,7 +566,7 @@ class ProjectManager:
                 f"Error in chat message: {str(e)}\nTraceback:\n{traceback.format_exc()}"
             )
             self.sandbox_status = SandboxStatus.READY
-            await self.emit_project(await self._get_project_status())
+            await self.emit_project_status()
 
     async def on_chat_message(self, chat_id: int, message: ChatMessage):
         self.last_activity = datetime.datetime.now()
@@ -276,28 +576,48 @@ class ProjectManager:
         self.lock.release()
 
     async def emit_project(self, data: BaseModel):
-        await asyncio.gather(
-            *[self.emit_chat(chat_id, data) for chat_id in self.chat_sockets]
-        )
-
-    async def emit_chat(self, chat_id: int, data: BaseModel):
+        frame = _Frame(data)
+        for chat_id in list(self.chat_sockets):
+            self.flush_chat(chat_id)
+            self._send_frame(chat_id, frame)
+
+    def flush_chat(self, chat_id: int):
+        if coalescer := self.chat_coalescers.get(chat_id):
+            coalescer.flush()
+
+    def _send_frame(self, chat_id: int, frame: _Frame):
+        for socket in list(self.chat_sockets.get(chat_id, [])):
+            if writer := self.socket_writers.get(id(socket)):
+                writer.send(frame)
+
+    async def emit_chat(self, chat_id: int, data: BaseModel, flush: bool = False):
+        """Queue a message for the chat's sockets, this doesn't wait on slow clients."""
         if chat_id not in self.chat_sockets:
             return
-        sockets = list(self.chat_sockets[chat_id])
+        if isinstance(data, ChatChunkResponse):
+            self.chat_coalescers[chat_id].add(data)
+            if flush:
+                self.flush_chat(chat_id)
+            return
+        # Keep ordering, anything buffered goes out before this message
+        self.flush_chat(chat_id)
+        self._send_frame(chat_id, _Frame(data))
 
-        async def _try_send(socket: WebSocket):
-            try:
-                await socket.send_json(data.model_dump())
-            except Exception:
-                try:
-                    self.chat_sockets[chat_id].remove(socket)
-                except ValueError:
-                    pass
 
-        await asyncio.gather(*[_try_send(socket) for socket in sockets])
+project_managers: Dict[int, ProjectManager] = {}
 
 
-project_managers: Dict[int, ProjectManager] = {}
+def get_or_start_project_manager(project_id: int) -> ProjectManager:
+    """
+    The project's live manager, starting one (which claims and boots the sandbox) if there
+    isn't one. Called ahead of the websocket (e.g. on chat creation) to boot the sandbox early.
+    """
+    pm = project_managers.get(project_id)
+    if pm is None or pm.killed:
+        pm = ProjectManager(next(get_db()), project_id)
+        pm.start()
+        project_managers[project_id] = pm
+    return pm
 
 
 @router.websocket("/api/ws/chat/{chat_id}")
@@ -313,12 +633,7 @@ async def websocket_endpoint(websocket: WebSocket, chat_id: int):
     if project is None:
         raise WebSocketException(code=404, reason="Project not found")
 
-    if project.id not in project_managers or project_managers[project.id].killed:
-        pm = ProjectManager(db, project.id)
-        pm.start()
-        project_managers[project.id] = pm
-    else:
-        pm = project_managers[project.id]
+    pm = get_or_start_project_manager(project.id)
 
     await websocket.accept()
     await pm.add_chat_socket(chat_id, websocket)
@@ -326,7 +641,11 @@ async def websocket_endpoint(websocket: WebSocket, chat_id: int):
     try:
         while not pm.killed:
             raw_data = await websocket.receive_text()
-            data = ChatMessage.model_validate_json(raw_data)
+            payload = json.loads(raw_data)
+            if payload.get("for_type") == "status_resync":
+                await pm.send_status_snapshot(websocket)
+                continue
+            data = ChatMessage.model_validate(payload)
             create_task(pm.on_chat_message(chat_id, data))
     except WebSocketDisconnect:
         pass
@@ -3,8 +3,9 @@ from typing import List
 from sqlalchemy.orm import Session
 
 from db.database import get_db
-from schemas.models import StackResponse
+from schemas.models import StackResponse, PreparedSandboxPoolStats
 from db.models import Stack
+from sandbox.pool import prepared_sandbox_pool
 
 router = APIRouter(prefix="/api/stacks", tags=["stacks"])
 
@@ -15,3 +16,15 @@ async def get_stacks(db: Session = Depends(get_db)):
     Get all available stacks that can be used as templates for new projects.
     """
     return db.query(Stack).all()
+
+
+@router.get("/pool", response_model=List[PreparedSandboxPoolStats])
+async def get_prepared_sandbox_pool(db: Session = Depends(get_db)):
+    """
+    Get the prepared sandbox pool of each stack (target, ready, preparing) and how often
+    projects found a prepared sandbox waiting, across all workers.
+    """
+    return [
+        PreparedSandboxPoolStats(stack_id=stack_id, **stats)
+        for stack_id, stats in prepared_sandbox_pool.stats(db).items()
+    ]
@@ -1,9 +1,37 @@
-from playwright.async_api import async_playwright, Browser, Page
-from typing import List, Optional
+from playwright.async_api import (
+    async_playwright,
+    Browser,
+    BrowserContext,
+    ConsoleMessage,
+    Page,
+    Request,
+)
+from typing import AsyncIterator, List, Optional, Set
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from urllib.parse import urlparse
 import asyncio
 import gc
 import base64
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+
+from config import (
+    BROWSER_POOL_SIZE,
+    BROWSER_LEASE_TIMEOUT_SECONDS,
+    BROWSER_READINESS_MODE,
+    BROWSER_SETTLE_WINDOW_MS,
+)
+
+# Records when the DOM last changed so readiness can wait for it to be quiet
+_TRACK_DOM_MUTATIONS_SCRIPT = """
+window.__sparkLastMutationAt = performance.now();
+new MutationObserver(() => {
+    window.__sparkLastMutationAt = performance.now();
+}).observe(document, { subtree: true, childList: true, attributes: true, characterData: true });
+"""
+
+# Long-lived connections that never finish and shouldn't block readiness
+_IGNORED_RESOURCE_TYPES = {"eventsource", "websocket"}
 
 
 @dataclass
@@ -15,6 +43,40 @@ class PageCheckResult:
     screenshot: Optional[str] = None  # Base64 encoded screenshot
 
 
+@dataclass
+class _PooledContext:
+    """An isolated browser context (cookies, storage) with a single reusable page."""
+
+    key: str
+    context: BrowserContext
+    page: Page
+    console_messages: List[str] = field(default_factory=list)
+    page_errors: List[str] = field(default_factory=list)
+    pending_requests: Set[Request] = field(default_factory=set)
+    last_network_activity: float = 0.0
+    hmr_rebuilding: bool = False
+
+    def clear_state(self):
+        self.console_messages = []
+        self.page_errors = []
+
+    def on_console(self, msg: ConsoleMessage):
+        self.console_messages.append(f"[{msg.type}] {msg.text}")
+        if "[Fast Refresh] rebuilding" in msg.text:
+            self.hmr_rebuilding = True
+        elif "[Fast Refresh] done" in msg.text:
+            self.hmr_rebuilding = False
+
+    def on_request_start(self, request: Request):
+        self.last_network_activity = asyncio.get_event_loop().time()
+        if request.resource_type not in _IGNORED_RESOURCE_TYPES:
+            self.pending_requests.add(request)
+
+    def on_request_end(self, request: Request):
+        self.last_network_activity = asyncio.get_event_loop().time()
+        self.pending_requests.discard(request)
+
+
 class BrowserMonitor:
     _instance = None
     _initialized = False
@@ -29,11 +91,16 @@ class BrowserMonitor:
     def __init__(self):
         if not BrowserMonitor._initialized:
             self._browser: Optional[Browser] = None
-            self._page: Optional[Page] = None
-            self._console_messages: List[str] = []
-            self._page_errors: List[str] = []
-            self._lock = asyncio.Lock()
             self._playwright = None
+            self._setup_lock = asyncio.Lock()
+            self._pool_size = max(1, BROWSER_POOL_SIZE)
+            # Lease slots, waiters on an asyncio.Queue are served first come first served
+            self._slots: asyncio.Queue = asyncio.Queue()
+            for _ in range(self._pool_size):
+                self._slots.put_nowait(None)
+            self._leased_cnt = 0
+            # Idle contexts by key, least recently used first
+            self._idle_contexts: "OrderedDict[str, _PooledContext]" = OrderedDict()
             BrowserMonitor._initialized = True
 
     @classmethod
@@ -43,11 +110,12 @@ class BrowserMonitor:
         return cls._instance
 
     async def _ensure_setup(self):
-        if not self._browser:
-            await self._setup()
+        async with self._setup_lock:
+            if not self._browser:
+                await self._setup()
 
     async def _setup(self):
-        """Initialize the browser and page with memory-optimized settings."""
+        """Initialize the browser with memory-optimized settings."""
         if self._browser is not None:
             await self.cleanup()
 
@@ -72,103 +140,171 @@ class BrowserMonitor:
             ]
         )
 
-        # Create a single reusable page
-        self._page = await self._browser.new_page()
+    async def _new_context(self, key: str) -> _PooledContext:
+        context = await self._browser.new_context(
+            viewport={"width": 1280, "height": 720}
+        )
+        await context.add_init_script(_TRACK_DOM_MUTATIONS_SCRIPT)
+        page = await context.new_page()
+        pooled = _PooledContext(key=key, context=context, page=page)
 
         # Configure page for memory optimization
-        await self._page.route(
-            "**/*", lambda route: route.continue_()
-        )  # Minimal routing
-        await self._page.set_viewport_size({"width": 1280, "height": 720})
+        await page.route("**/*", lambda route: route.continue_())  # Minimal routing
 
         # Listen for console messages
-        self._page.on(
-            "console",
-            lambda msg: self._console_messages.append(f"[{msg.type}] {msg.text}"),
-        )
+        page.on("console", pooled.on_console)
         # Listen for page errors
-        self._page.on(
-            "pageerror", lambda err: self._page_errors.append(f"Page error: {err}")
+        page.on(
+            "pageerror", lambda err: pooled.page_errors.append(f"Page error: {err}")
         )
+        # Track in-flight requests for readiness
+        page.on("request", pooled.on_request_start)
+        page.on("requestfinished", pooled.on_request_end)
+        page.on("requestfailed", pooled.on_request_end)
+        return pooled
 
-    async def _maybe_run_gc(self):
+    async def _close_context(self, pooled: _PooledContext):
+        try:
+            await pooled.context.close()
+        except Exception as e:
+            print(f"Error closing browser context: {e}")
+
+    @asynccontextmanager
+    async def _lease(self, key: str) -> AsyncIterator[_PooledContext]:
+        """Lease a context for `key`, reusing that key's idle context when there is one."""
+        pooled = None
+        healthy = False
+        self._leased_cnt += 1
+        try:
+            pooled = self._idle_contexts.pop(key, None)
+            if pooled is None:
+                if self._idle_contexts and (
+                    len(self._idle_contexts) + self._leased_cnt > self._pool_size
+                ):
+                    _, evicted = self._idle_contexts.popitem(last=False)
+                    await self._close_context(evicted)
+                pooled = await self._new_context(key)
+            pooled.clear_state()
+            pooled.pending_requests.clear()
+            pooled.hmr_rebuilding = False
+            yield pooled
+            healthy = True
+        finally:
+            self._leased_cnt -= 1
+            if pooled is not None:
+                # An overlapping lease of the same key may have returned its context first
+                if (
+                    healthy
+                    and self._browser is not None
+                    and key not in self._idle_contexts
+                ):
+                    self._idle_contexts[key] = pooled
+                else:
+                    await self._close_context(pooled)
+
+    async def _maybe_run_gc(self, page: Page):
         """Run garbage collection if enough time has passed."""
         current_time = asyncio.get_event_loop().time()
         if current_time - self._last_gc_time > self._GC_INTERVAL:
-            if self._page:
-                try:
-                    await self._page.evaluate("() => { if (window.gc) window.gc() }")
-                except Exception:
-                    pass  # Ignore if gc is not available
+            try:
+                await page.evaluate("() => { if (window.gc) window.gc() }")
+            except Exception:
+                pass  # Ignore if gc is not available
             gc.collect()  # Python-level garbage collection
             self._last_gc_time = current_time
 
-    def _clear_state(self):
-        self._console_messages = []
-        self._page_errors = []
+    async def _wait_until_settled(self, pooled: _PooledContext, max_wait: float):
+        """Wait until the DOM and network have been quiet and HMR is idle, at most `max_wait` seconds."""
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + max_wait
+        settle_window = BROWSER_SETTLE_WINDOW_MS / 1000
+        while loop.time() < deadline:
+            try:
+                dom_quiet_ms = await pooled.page.evaluate(
+                    "() => performance.now() - (window.__sparkLastMutationAt || 0)"
+                )
+            except Exception:
+                dom_quiet_ms = 0
+            network_quiet = not pooled.pending_requests and (
+                loop.time() - pooled.last_network_activity >= settle_window
+            )
+            if (
+                network_quiet
+                and dom_quiet_ms >= BROWSER_SETTLE_WINDOW_MS
+                and not pooled.hmr_rebuilding
+            ):
+                return
+            await asyncio.sleep(min(0.1, max(0.0, deadline - loop.time())))
 
     async def check_page(
-        self, url: str, wait_time: int = 3, lock_timeout: float = 5.0
+        self,
+        url: str,
+        wait_time: int = 3,
+        lease_timeout: Optional[float] = None,
+        readiness: Optional[str] = None,
     ) -> Optional[PageCheckResult]:
         """Navigate to the URL and check for errors/messages.
 
         Args:
             url: The URL to check
-            wait_time: Time to wait after page load to capture errors
-            lock_timeout: Maximum time to wait for lock acquisition in seconds
+            wait_time: Time to wait after page load to capture errors (an upper bound in adaptive mode)
+            lease_timeout: Maximum time to wait in line for a browser context in seconds
+            readiness: "adaptive" to stop waiting once the page has settled or "fixed" to always wait `wait_time`
         """
+        readiness = readiness or BROWSER_READINESS_MODE
+        if lease_timeout is None:
+            lease_timeout = BROWSER_LEASE_TIMEOUT_SECONDS
         try:
-            # Try to acquire the lock with timeout
-            try:
-                await asyncio.wait_for(self._lock.acquire(), timeout=lock_timeout)
-            except asyncio.TimeoutError:
-                return PageCheckResult(
-                    errors=[],
-                    console=[
-                        f"Browser status not currently available. This is not an error."
-                    ],
-                )
+            await asyncio.wait_for(self._slots.get(), timeout=lease_timeout)
+        except asyncio.TimeoutError:
+            return PageCheckResult(
+                errors=[],
+                console=[
+                    f"Browser status not currently available. This is not an error."
+                ],
+            )
 
+        try:
             await self._ensure_setup()
 
-            try:
+            # Each site (i.e. each project's preview) gets its own cookies and storage
+            async with self._lease(urlparse(url).netloc) as pooled:
                 # Clear memory before loading new page
-                await self._maybe_run_gc()
+                await self._maybe_run_gc(pooled.page)
 
                 print(f"Navigating browser to {url}")
-                await self._page.goto(url, wait_until="networkidle")
+                await pooled.page.goto(
+                    url, wait_until="load" if readiness == "adaptive" else "networkidle"
+                )
                 # Clear previous errors/messages
-                self._clear_state()
+                pooled.clear_state()
 
-                # Wait for specified time to capture any errors
-                await asyncio.sleep(wait_time)
+                # Wait for the page to settle (or the specified time) to capture any errors
+                if readiness == "adaptive":
+                    await self._wait_until_settled(pooled, wait_time)
+                else:
+                    await asyncio.sleep(wait_time)
 
                 # Capture screenshot
-                screenshot_bytes = await self._page.screenshot(type="jpeg", quality=80)
+                screenshot_bytes = await pooled.page.screenshot(type="jpeg", quality=80)
                 screenshot_base64 = base64.b64encode(screenshot_bytes).decode("utf-8")
 
                 return PageCheckResult(
-                    errors=self._page_errors.copy(),
-                    console=self._console_messages.copy(),
+                    errors=pooled.page_errors.copy(),
+                    console=pooled.console_messages.copy(),
                     screenshot=screenshot_base64,
                 )
-            except Exception as e:
-                print(f"Error checking page: {e}")
-                return PageCheckResult(errors=[f"Error checking page: {e}"], console=[])
-            finally:
-                self._lock.release()
-        except asyncio.TimeoutError:
-            return PageCheckResult(
-                errors=[],
-                console=[],
-            )
+        except Exception as e:
+            print(f"Error checking page: {e}")
+            return PageCheckResult(errors=[f"Error checking page: {e}"], console=[])
+        finally:
+            self._slots.put_nowait(None)
 
     async def cleanup(self):
         """Clean up browser resources."""
-        if self._page:
-            await self._maybe_run_gc()
-            await self._page.close()
-            self._page = None
+        while self._idle_contexts:
+            _, pooled = self._idle_contexts.popitem()
+            await self._close_context(pooled)
 
         if self._browser:
             await self._browser.close()
@@ -178,5 +314,4 @@ class BrowserMonitor:
             await self._playwright.stop()
             self._playwright = None
 
-        self._clear_state()
         gc.collect()  # Final garbage collection
@@ -0,0 +1,311 @@
+import modal
+import asyncio
+import json
+from dataclasses import dataclass
+from typing import AsyncGenerator, Callable, Dict, List, Optional, Tuple
+
+from config import SANDBOX_DAEMON_IDLE_TIMEOUT_SECONDS
+
+# Modal buffers at most 2MiB of stdin between drains
+_STDIN_CHUNK_SIZE = 1024 * 1024
+
+# Runs inside the sandbox, serves JSON line requests from stdin and answers on stdout.
+# Requests carry an id and are handled concurrently, every event sent back carries the same id.
+# Each request is acknowledged with an "accepted" event as soon as it is read.
+_DAEMON_SCRIPT = """
+import asyncio
+import codecs
+import json
+import os
+import signal
+import sys
+import tempfile
+
+IDLE_TIMEOUT = float(sys.argv[1])
+
+
+def send(msg):
+    sys.stdout.write(json.dumps(msg) + "\\n")
+    sys.stdout.flush()
+
+
+async def handle_exec(req):
+    proc = await asyncio.create_subprocess_shell(
+        req["command"],
+        cwd=req.get("workdir") or "/app",
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+        start_new_session=True,
+    )
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    async def pump():
+        while True:
+            data = await proc.stdout.read(8192)
+            if not data:
+                break
+            text = decoder.decode(data)
+            if text:
+                send({"id": req["id"], "event": "output", "data": text})
+        await proc.wait()
+
+    timed_out = False
+    try:
+        await asyncio.wait_for(pump(), req.get("timeout"))
+    except asyncio.TimeoutError:
+        timed_out = True
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        await proc.wait()
+    send({"id": req["id"], "event": "exit", "code": proc.returncode, "timed_out": timed_out})
+
+
+def write_files(files):
+    staged = []
+    try:
+        for file in files:
+            path = os.path.abspath(file["path"])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".spark-write-")
+            staged.append((tmp_path, path))
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(file["content"])
+            os.chmod(tmp_path, os.stat(path).st_mode if os.path.exists(path) else 0o644)
+    except Exception:
+        for tmp_path, _ in staged:
+            os.remove(tmp_path)
+        raise
+    for tmp_path, path in staged:
+        os.replace(tmp_path, path)
+
+
+async def handle_write(req):
+    await asyncio.get_event_loop().run_in_executor(None, write_files, req["files"])
+    send({"id": req["id"], "event": "done"})
+
+
+async def handle(req):
+    send({"id": req["id"], "event": "accepted"})
+    try:
+        if req["op"] == "exec":
+            await handle_exec(req)
+        elif req["op"] == "write":
+            await handle_write(req)
+        elif req["op"] == "ping":
+            send({"id": req["id"], "event": "done"})
+        else:
+            raise ValueError("Unknown op " + req["op"])
+    except Exception as e:
+        send({"id": req["id"], "event": "error", "message": repr(e)})
+
+
+async def main():
+    loop = asyncio.get_event_loop()
+    reader = asyncio.StreamReader(limit=1 << 30)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    tasks = set()
+    while True:
+        try:
+            line = await asyncio.wait_for(reader.readline(), IDLE_TIMEOUT)
+        except asyncio.TimeoutError:
+            if tasks:
+                continue
+            break
+        if not line:
+            break
+        task = loop.create_task(handle(json.loads(line)))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.wait(tasks)
+
+
+asyncio.get_event_loop().run_until_complete(main())
+"""
+
+_FINAL_EVENTS = {"exit", "done", "error"}
+
+
+class SandboxDaemonError(Exception):
+    """
+    The helper process isn't running (or died). `sent` tells whether the process may have
+    started handling the request, only requests that weren't sent are safe to retry with
+    sb.exec.
+    """
+
+    def __init__(self, message: str, sent: bool = False):
+        super().__init__(message)
+        self.sent = sent
+
+
+@dataclass
+class CommandResult:
+    output: str
+    exit_code: Optional[int]
+    timed_out: bool = False
+
+
+class JsonLinesProcess:
+    """
+    Client for a long-lived helper process inside a sandbox speaking JSON lines.
+
+    Requests are tagged with an id and multiplexed over the stdin/stdout of a single exec,
+    the process answers with events carrying the same id, ending with a final event.
+    """
+
+    def __init__(self, sb: modal.Sandbox):
+        self.sb = sb
+        self._proc = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._next_id = 0
+        self._streams: Dict[int, asyncio.Queue] = {}
+        self._write_lock = asyncio.Lock()
+
+    @property
+    def alive(self) -> bool:
+        return self._reader_task is not None and not self._reader_task.done()
+
+    async def _spawn(self, *cmds: str, workdir: str, timeout: float):
+        self._proc = await self.sb.exec.aio(*cmds, workdir=workdir)
+        self._reader_task = asyncio.create_task(self._read_loop())
+        try:
+            await asyncio.wait_for(self._request({"op": "ping"}), timeout=timeout)
+        except BaseException:
+            await self._stop()
+            raise
+
+    async def _stop(self):
+        """Stop a process that never became ready, it exits once its stdin is closed."""
+        self._reader_task.cancel()
+        try:
+            self._proc.stdin.write_eof()
+            await asyncio.wait_for(self._proc.stdin.drain.aio(), timeout=5)
+        except Exception as e:
+            print(f"Failed to stop {type(self).__name__}: {e}")
+
+    async def _read_loop(self):
+        buffer = ""
+        try:
+            async for chunk in self._proc.stdout:
+                buffer += chunk
+                *lines, buffer = buffer.split("\n")
+                for line in lines:
+                    if not line.strip():
+                        continue
+                    event = json.loads(line)
+                    if queue := self._streams.get(event["id"]):
+                        queue.put_nowait(event)
+        except Exception as e:
+            print(f"{type(self).__name__} reader stopped: {e}")
+        finally:
+            # Wake up everyone still waiting, the process won't answer them anymore
+            for queue in self._streams.values():
+                queue.put_nowait(None)
+
+    async def _events(self, request: dict) -> AsyncGenerator[dict, None]:
+        if not self.alive:
+            raise SandboxDaemonError(f"{type(self).__name__} is not running")
+        self._next_id += 1
+        request_id = self._next_id
+        queue: asyncio.Queue = asyncio.Queue()
+        self._streams[request_id] = queue
+        try:
+            data = (json.dumps({**request, "id": request_id}) + "\n").encode("utf-8")
+            # Until the final chunk (with the newline) is written the request can't run
+            sent = False
+            try:
+                async with self._write_lock:
+                    for i in range(0, len(data), _STDIN_CHUNK_SIZE):
+                        self._proc.stdin.write(data[i : i + _STDIN_CHUNK_SIZE])
+                        sent = i + _STDIN_CHUNK_SIZE >= len(data)
+                        await self._proc.stdin.drain.aio()
+            except Exception as e:
+                raise SandboxDaemonError(
+                    f"Failed to send to {type(self).__name__}: {e}", sent=sent
+                )
+            # An exit before the request is accepted (e.g. the process hit its idle
+            # timeout as the request arrived) means it never ran
+            accepted = False
+            while True:
+                event = await queue.get()
+                if event is None:
+                    raise SandboxDaemonError(
+                        f"{type(self).__name__} exited", sent=accepted
+                    )
+                if event["event"] == "accepted":
+                    accepted = True
+                    continue
+                yield event
+                if event["event"] in _FINAL_EVENTS:
+                    return
+        finally:
+            del self._streams[request_id]
+
+    async def _request(self, request: dict) -> dict:
+        async for event in self._events(request):
+            if event["event"] in _FINAL_EVENTS:
+                return event
+
+    async def close(self):
+        if self.alive:
+            self._proc.stdin.write_eof()
+            await self._proc.stdin.drain.aio()
+
+
+class SandboxDaemon(JsonLinesProcess):
+    """
+    The sandbox's command daemon, commands and file writes go over one exec which avoids
+    spawning a process (and an exec round trip) for every call.
+    """
+
+    async def start(self, timeout: float = 20):
+        await self._spawn(
+            "python3",
+            "-u",
+            "-c",
+            _DAEMON_SCRIPT,
+            str(SANDBOX_DAEMON_IDLE_TIMEOUT_SECONDS),
+            workdir="/app",
+            timeout=timeout,
+        )
+
+    async def run(
+        self,
+        command: str,
+        workdir: Optional[str] = None,
+        timeout: Optional[float] = None,
+        on_output: Optional[Callable[[str], None]] = None,
+    ) -> CommandResult:
+        """Run a shell command, calling `on_output` with output (stdout and stderr) as it arrives."""
+        output = []
+        async for event in self._events(
+            {"op": "exec", "command": command, "workdir": workdir, "timeout": timeout}
+        ):
+            if event["event"] == "output":
+                output.append(event["data"])
+                if on_output:
+                    on_output(event["data"])
+            elif event["event"] == "exit":
+                return CommandResult(
+                    output="".join(output),
+                    exit_code=event["code"],
+                    timed_out=event["timed_out"],
+                )
+            elif event["event"] == "error":
+                raise RuntimeError(f"Failed to run command: {event['message']}")
+
+    async def write_files(self, files: List[Tuple[str, str]]):
+        """Write files (absolute or relative to /app), swapping them all in once every file is staged."""
+        event = await self._request(
+            {
+                "op": "write",
+                "files": [
+                    {"path": path, "content": content} for path, content in files
+                ],
+            }
+        )
+        if event["event"] == "error":
+            raise RuntimeError(f"Failed to write files: {event['message']}")
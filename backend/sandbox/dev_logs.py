@@ -0,0 +1,152 @@
+import asyncio
+import posixpath
+import re
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, List, Optional
+
+from config import DEV_SERVER_LOG_MAX_LINES
+
+_ANSI_ESCAPE_PATTERN = re.compile(r"\x1b\[[0-9;?]*[A-Za-z]")
+
+# Dev server output that marks a state change, checked in order (Next.js and Angular)
+_EVENT_PATTERNS = [
+    (
+        "error",
+        re.compile(
+            r"Failed to compile|Module not found|SyntaxError|error TS\d+|^\s*⨯|^\s*ERROR\b|\[ERROR\]"
+        ),
+    ),
+    ("ready", re.compile(r"Ready in|ready started server|Local:\s+https?://")),
+    (
+        "compiled",
+        re.compile(
+            r"Compiled\b.*(successfully|in \d)|✓ Compiled|compiled successfully"
+        ),
+    ),
+]
+
+
+# Files the dev server rebuilds on, changes to anything else don't produce a compile
+WATCHED_SOURCE_EXTENSIONS = {
+    ".js",
+    ".jsx",
+    ".mjs",
+    ".cjs",
+    ".ts",
+    ".tsx",
+    ".css",
+    ".scss",
+    ".sass",
+    ".html",
+}
+
+
+def is_watched_source(path: str) -> bool:
+    return posixpath.splitext(path)[1] in WATCHED_SOURCE_EXTENSIONS and (
+        "/node_modules/" not in path
+    )
+
+
+@dataclass
+class DevServerEvent:
+    seq: int
+    kind: str  # "ready", "compiled" or "error"
+    line: str
+    line_no: int  # Position of the line in the whole log
+
+
+class DevServerLogs:
+    """
+    Captures the sandbox's dev server output (the start command's stdout/stderr).
+
+    Keeps the most recent lines in a ring buffer and parses them for ready, compiled and
+    error events so readiness and post-apply checks don't have to poll.
+    """
+
+    def __init__(self, max_lines: int = DEV_SERVER_LOG_MAX_LINES):
+        self.lines: Deque[str] = deque(maxlen=max_lines)
+        self.events: Deque[DevServerEvent] = deque(maxlen=max_lines)
+        self.event_seq = 0
+        self.line_cnt = 0
+        self.ready = asyncio.Event()
+        self.exited = asyncio.Event()
+        self._new_event = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self, streams: List):
+        """Start reading the given (text) stream readers, e.g. sb.stdout and sb.stderr."""
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._read(stream)) for stream in streams]
+        asyncio.create_task(self._wait_exited())
+
+    async def _wait_exited(self):
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self.exited.set()
+        self._notify_event()
+
+    async def _read(self, stream):
+        partial = ""
+        try:
+            async for chunk in stream:
+                *lines, partial = (partial + chunk).split("\n")
+                if lines:
+                    self.feed(lines)
+        except Exception as e:
+            print(f"Error reading dev server logs: {e}")
+        if partial:
+            self.feed([partial])
+
+    def feed(self, lines: List[str]):
+        lines = [_ANSI_ESCAPE_PATTERN.sub("", line).rstrip("\r") for line in lines]
+        for line in lines:
+            self.lines.append(line)
+            self.line_cnt += 1
+            for kind, pattern in _EVENT_PATTERNS:
+                if pattern.search(line):
+                    self.event_seq += 1
+                    self.events.append(
+                        DevServerEvent(self.event_seq, kind, line, self.line_cnt - 1)
+                    )
+                    if kind == "ready":
+                        self.ready.set()
+                    self._notify_event()
+                    break
+
+    def _notify_event(self):
+        self._new_event.set()
+        self._new_event = asyncio.Event()
+
+    def tail(self, n: int) -> List[str]:
+        return list(self.lines)[-n:]
+
+    def lines_from(self, line_no: int, n: int) -> List[str]:
+        """Up to `n` lines starting at `line_no`, as far as they are still buffered."""
+        start = max(0, line_no - (self.line_cnt - len(self.lines)))
+        return list(self.lines)[start : start + n]
+
+    def events_since(self, seq: int) -> List[DevServerEvent]:
+        return [event for event in self.events if event.seq > seq]
+
+    async def wait_for_compile(
+        self, after_seq: int, timeout: float
+    ) -> Optional[DevServerEvent]:
+        """Wait for the first compiled/error event after `after_seq`, None on timeout."""
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout
+        while True:
+            for event in self.events_since(after_seq):
+                if event.kind in ("compiled", "error"):
+                    return event
+            remaining = deadline - loop.time()
+            if remaining <= 0 or self.exited.is_set():
+                return None
+            try:
+                await asyncio.wait_for(self._new_event.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                return None
+
+    def close(self):
+        for task in self._tasks:
+            task.cancel()
@@ -0,0 +1,141 @@
+import modal
+import hashlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Tuple
+
+from config import SANDBOX_FILE_CACHE_MAX_BYTES, SANDBOX_FILE_CACHE_MAX_ENTRIES
+
+
+def _blob_id(content: bytes) -> str:
+    """Git-style blob id, identical files (e.g. stack templates) share one cached copy."""
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+
+@dataclass
+class _CachedFile:
+    blob_id: Optional[str]  # None if the file does not exist
+    size: int
+    epoch: int  # project epoch the entry was read or written in
+
+
+class ProjectFileCache:
+    """
+    Read-through cache of project volume files.
+
+    Entries are keyed on (project, path) and point at content stored by blob id in a size
+    bounded LRU. Reads and writes through the sandbox fill entries, which are served without
+    touching the volume until anything else that may change files (shell commands) bumps the
+    project's epoch. Entries from an older epoch are read again.
+    """
+
+    def __init__(self, max_bytes: int, max_entries: int):
+        self._max_bytes = max_bytes
+        self._max_entries = max_entries
+        self._blobs: "OrderedDict[str, bytes]" = OrderedDict()
+        self._blob_bytes = 0
+        self._files: "OrderedDict[Tuple[int, str], _CachedFile]" = OrderedDict()
+        self._epochs: Dict[int, int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _epoch(self, project_id: int) -> int:
+        return self._epochs.get(project_id, 0)
+
+    def _store_blob(self, content: bytes) -> str:
+        blob_id = _blob_id(content)
+        if blob_id in self._blobs:
+            self._blobs.move_to_end(blob_id)
+            return blob_id
+        if len(content) > self._max_bytes:
+            return blob_id
+        self._blobs[blob_id] = content
+        self._blob_bytes += len(content)
+        while self._blob_bytes > self._max_bytes:
+            _, evicted = self._blobs.popitem(last=False)
+            self._blob_bytes -= len(evicted)
+        return blob_id
+
+    def _set_entry(self, project_id: int, path: str, entry: _CachedFile):
+        key = (project_id, path)
+        self._files[key] = entry
+        self._files.move_to_end(key)
+        while len(self._files) > self._max_entries:
+            self._files.popitem(last=False)
+
+    def _lookup(self, project_id: int, path: str) -> Tuple[Optional[_CachedFile], bool]:
+        """Return (entry, usable) where usable means the content is still in memory."""
+        entry = self._files.get((project_id, path))
+        if entry is None:
+            return None, False
+        return entry, entry.blob_id is None or entry.blob_id in self._blobs
+
+    def _content(self, entry: _CachedFile) -> Optional[bytes]:
+        if entry.blob_id is None:
+            return None
+        self._blobs.move_to_end(entry.blob_id)
+        return self._blobs[entry.blob_id]
+
+    def put(self, project_id: int, path: str, content: bytes):
+        blob_id = self._store_blob(content)
+        self._set_entry(
+            project_id,
+            path,
+            _CachedFile(
+                blob_id=blob_id, size=len(content), epoch=self._epoch(project_id)
+            ),
+        )
+
+    def invalidate(self, project_id: int, paths: Optional[Iterable[str]] = None):
+        if paths is None:
+            for key in [key for key in self._files if key[0] == project_id]:
+                del self._files[key]
+            return
+        for path in paths:
+            self._files.pop((project_id, path), None)
+
+    def mark_dirty(self, project_id: int):
+        """Files may have changed outside of the cache, read entries again before use."""
+        self._epochs[project_id] = self._epoch(project_id) + 1
+
+    async def _read(self, vol: modal.Volume, path: str) -> Optional[bytes]:
+        data = b""
+        try:
+            async for chunk in vol.read_file.aio(path):
+                data += chunk
+        except FileNotFoundError:
+            return None
+        return data
+
+    async def read(
+        self, project_id: int, vol: modal.Volume, path: str
+    ) -> Optional[bytes]:
+        """Read a file (None if it doesn't exist), serving from memory when still valid."""
+        epoch = self._epoch(project_id)
+        entry, usable = self._lookup(project_id, path)
+        if entry is not None and usable and entry.epoch == epoch:
+            self.hits += 1
+            return self._content(entry)
+
+        self.misses += 1
+        key = (project_id, path)
+        entry_before = self._files.get(key)
+        content = await self._read(vol, path)
+        # A write or invalidation happened meanwhile, what we read may already be outdated
+        if self._files.get(key) is not entry_before or self._epoch(project_id) != epoch:
+            return content
+        self._set_entry(
+            project_id,
+            path,
+            _CachedFile(
+                blob_id=self._store_blob(content) if content is not None else None,
+                size=len(content) if content is not None else 0,
+                epoch=epoch,
+            ),
+        )
+        return content
+
+
+file_cache = ProjectFileCache(
+    SANDBOX_FILE_CACHE_MAX_BYTES, SANDBOX_FILE_CACHE_MAX_ENTRIES
+)
@@ -0,0 +1,123 @@
+import modal
+import asyncio
+from typing import Iterable, List, Optional, Set, Tuple
+from modal.volume import FileEntryType
+from functools import lru_cache
+
+from config import FILE_INDEX_LISTDIR_CONCURRENCY
+
+IGNORE_PATHS = ["node_modules", ".git", ".next", "build", "git.log", "tmp"]
+
+
+def _is_ignored(path: str) -> bool:
+    return any(part in IGNORE_PATHS for part in path.split("/"))
+
+
+async def _read_vol_text(vol: modal.Volume, path: str) -> Optional[str]:
+    data = b""
+    try:
+        async for chunk in vol.read_file.aio(path):
+            data += chunk
+    except FileNotFoundError:
+        return None
+    return data.decode("utf-8", errors="replace")
+
+
+async def read_git_head(vol: modal.Volume) -> Optional[str]:
+    """Resolve the HEAD commit sha straight from the volume (no sandbox exec needed)."""
+    head = await _read_vol_text(vol, ".git/HEAD")
+    if head is None:
+        return None
+    head = head.strip()
+    if not head.startswith("ref: "):
+        return head or None
+    ref = head[len("ref: ") :]
+    sha = await _read_vol_text(vol, f".git/{ref}")
+    if sha:
+        return sha.strip()
+    packed_refs = await _read_vol_text(vol, ".git/packed-refs")
+    for line in (packed_refs or "").splitlines():
+        parts = line.strip().split(" ")
+        if len(parts) == 2 and parts[1] == ref:
+            return parts[0]
+    return None
+
+
+async def walk_volume(vol: modal.Volume) -> List[str]:
+    """List every non-ignored file, fanning out listdir calls across directories."""
+    semaphore = asyncio.Semaphore(FILE_INDEX_LISTDIR_CONCURRENCY)
+    paths = []
+
+    async def _walk(path: str):
+        async with semaphore:
+            entries = await vol.listdir.aio(path, recursive=False)
+        sub_dirs = []
+        for entry in entries:
+            if _is_ignored(entry.path):
+                continue
+            if entry.type == FileEntryType.DIRECTORY:
+                sub_dirs.append(entry.path)
+            else:
+                paths.append(entry.path)
+        await asyncio.gather(*[_walk(sub_dir) for sub_dir in sub_dirs])
+
+    await _walk("/")
+    return paths
+
+
+class ProjectFileIndex:
+    """
+    Cached file tree of a project volume.
+
+    The tree is keyed on the git HEAD it was built for. Files written through the sandbox
+    and the changes of commits made through the sandbox are applied in place, so a full
+    walk is only needed when HEAD moves in a way we didn't see (or on first use).
+    """
+
+    def __init__(self):
+        self._paths: Optional[Set[str]] = None
+        self._head: Optional[str] = None
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        self._paths = None
+        self._head = None
+
+    def mark_written(self, paths: Iterable[str]):
+        if self._paths is None:
+            return
+        for path in paths:
+            if not _is_ignored(path):
+                self._paths.add(path)
+
+    def record_commit(
+        self, head: str, parents: List[str], changes: List[Tuple[str, str]]
+    ):
+        """Move the index to `head` by applying the (status, path) changes of that commit."""
+        if self._paths is None or head == self._head:
+            return
+        # A root commit moves an index built before the repo had any commits
+        if self._head not in parents and (parents or self._head is not None):
+            self.invalidate()
+            return
+        for status, path in changes:
+            if _is_ignored(path):
+                continue
+            if status.startswith("D"):
+                self._paths.discard(path)
+            else:
+                self._paths.add(path)
+        self._head = head
+
+    async def get_paths(self, vol: modal.Volume) -> List[str]:
+        async with self._lock:
+            head = await read_git_head(vol)
+            if self._paths is None or head is None or head != self._head:
+                self._paths = set(await walk_volume(vol))
+                self._head = head
+            return sorted(self._paths)
+
+
+@lru_cache(maxsize=1024)
+def get_project_file_index(project_id: int) -> ProjectFileIndex:
+    return ProjectFileIndex()
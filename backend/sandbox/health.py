@@ -0,0 +1,118 @@
+import aiohttp
+import asyncio
+import random
+from typing import Dict, List, Optional
+
+from config import (
+    HEALTH_CHECK_TIMEOUT_SECONDS,
+    HEALTH_CHECK_MAX_CONNECTIONS,
+    HEALTH_CHECK_INTERVAL_SECONDS,
+    HEALTH_CHECK_FAILURE_THRESHOLD,
+)
+
+_session: Optional[aiohttp.ClientSession] = None
+
+
+def _get_session() -> aiohttp.ClientSession:
+    """Process-wide session so probes reuse pooled connections."""
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=HEALTH_CHECK_MAX_CONNECTIONS, ttl_dns_cache=300
+            ),
+            timeout=aiohttp.ClientTimeout(total=HEALTH_CHECK_TIMEOUT_SECONDS),
+        )
+    return _session
+
+
+async def is_url_up(url: str) -> bool:
+    try:
+        async with _get_session().get(url) as response:
+            return response.status < 500
+    except Exception:
+        return False
+
+
+async def wait_until_up(
+    url: str,
+    deadline_seconds: float,
+    wake: Optional[asyncio.Event] = None,
+    initial_delay: float = 0.25,
+    max_delay: float = 5.0,
+) -> bool:
+    """
+    Probe `url` with exponential backoff and full jitter until it's up (True) or the
+    deadline passes (False). Setting `wake` (e.g. the server logged it's ready) probes again
+    right away.
+    """
+    loop = asyncio.get_event_loop()
+    deadline = loop.time() + deadline_seconds
+    delay = initial_delay
+    while True:
+        if await is_url_up(url):
+            return True
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            return False
+        sleep_for = min(random.uniform(0, delay), remaining)
+        if wake is not None and not wake.is_set():
+            try:
+                await asyncio.wait_for(wake.wait(), timeout=sleep_for)
+            except asyncio.TimeoutError:
+                pass
+        else:
+            await asyncio.sleep(sleep_for)
+        delay = min(delay * 2, max_delay)
+
+
+class HealthProber:
+    """Checks every watched URL on one shared schedule instead of a loop per project."""
+
+    def __init__(self, interval: float, failure_threshold: int):
+        self._interval = interval
+        self._failure_threshold = failure_threshold
+        self._watchers: Dict[str, List[asyncio.Future]] = {}
+        self._failures: Dict[str, int] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def wait_until_down(self, url: str):
+        """Return once `url` failed `failure_threshold` probes in a row."""
+        future = asyncio.get_event_loop().create_future()
+        self._watchers.setdefault(url, []).append(future)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        try:
+            await future
+        finally:
+            watchers = self._watchers.get(url, [])
+            if future in watchers:
+                watchers.remove(future)
+            if not watchers:
+                self._watchers.pop(url, None)
+                self._failures.pop(url, None)
+
+    async def _run(self):
+        while self._watchers:
+            await asyncio.sleep(self._interval)
+            urls = list(self._watchers)
+            results = await asyncio.gather(*[is_url_up(url) for url in urls])
+            for url, up in zip(urls, results):
+                self._failures[url] = 0 if up else self._failures.get(url, 0) + 1
+                if self._failures[url] < self._failure_threshold:
+                    continue
+                for future in self._watchers.get(url, []):
+                    if not future.done():
+                        future.set_result(None)
+
+
+health_prober = HealthProber(
+    HEALTH_CHECK_INTERVAL_SECONDS, max(1, HEALTH_CHECK_FAILURE_THRESHOLD)
+)
+
+
+async def close_health_session():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
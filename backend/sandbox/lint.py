@@ -0,0 +1,119 @@
+import posixpath
+from dataclasses import dataclass
+from typing import List
+
+from sandbox.daemon import JsonLinesProcess
+from config import SANDBOX_DAEMON_IDLE_TIMEOUT_SECONDS
+
+ESLINT_CONFIG_PATH = "/app/frontend/.eslintrc.json"
+
+LINTABLE_EXTENSIONS = {".js", ".jsx", ".mjs", ".cjs", ".ts", ".tsx"}
+
+# Changes to these can change lint results of any file, a full `npm run lint` is needed
+LINT_CONFIG_FILE_PREFIXES = [
+    ".eslintrc",
+    "eslint.config.",
+    ".eslintignore",
+    "package.json",
+    "tsconfig",
+    "next.config.",
+]
+
+# Runs inside the sandbox next to the frontend, lints files with the project's own ESLint.
+# Keeping the ESLint instance alive keeps configs and plugins loaded between requests.
+_LINT_SERVER_SCRIPT = """
+const readline = require("readline");
+const { ESLint } = require(require.resolve("eslint", { paths: [process.cwd()] }));
+
+const IDLE_TIMEOUT_MS = Number(process.argv[1]) * 1000;
+const eslint = new ESLint({
+  cwd: process.cwd(),
+  cache: true,
+  cacheLocation: "node_modules/.cache/spark-stack-eslint",
+  errorOnUnmatchedPattern: false,
+});
+let idleTimer = null;
+let pending = 0;
+
+const send = (msg) => process.stdout.write(JSON.stringify(msg) + "\\n");
+const resetIdle = () => {
+  clearTimeout(idleTimer);
+  idleTimer = setTimeout(() => pending === 0 && process.exit(0), IDLE_TIMEOUT_MS);
+};
+
+const handle = async (req) => {
+  if (req.op === "ping") {
+    return send({ id: req.id, event: "done" });
+  }
+  const files = [];
+  for (const file of req.files) {
+    if (!(await eslint.isPathIgnored(file))) files.push(file);
+  }
+  const results = files.length ? await eslint.lintFiles(files) : [];
+  const formatter = await eslint.loadFormatter("stylish");
+  send({
+    id: req.id,
+    event: "done",
+    output: await formatter.format(results),
+    error_count: results.reduce((cnt, result) => cnt + result.errorCount, 0),
+  });
+};
+
+readline.createInterface({ input: process.stdin }).on("line", async (line) => {
+  const req = JSON.parse(line);
+  send({ id: req.id, event: "accepted" });
+  pending += 1;
+  resetIdle();
+  try {
+    await handle(req);
+  } catch (e) {
+    send({ id: req.id, event: "error", message: String((e && e.stack) || e) });
+  } finally {
+    pending -= 1;
+    resetIdle();
+  }
+}).on("close", () => process.exit(0));
+resetIdle();
+"""
+
+
+@dataclass
+class LintResult:
+    output: str
+    has_errors: bool
+    mode: str  # "incremental", "full" or "skipped"
+
+
+def is_lintable(path: str) -> bool:
+    return posixpath.splitext(path)[1] in LINTABLE_EXTENSIONS and (
+        "/node_modules/" not in path
+    )
+
+
+def is_lint_config(path: str) -> bool:
+    name = posixpath.basename(path)
+    return any(name.startswith(prefix) for prefix in LINT_CONFIG_FILE_PREFIXES)
+
+
+class LintServer(JsonLinesProcess):
+    """A warm ESLint process in the sandbox that lints only the files asked for."""
+
+    async def start(self, workdir: str, timeout: float = 30):
+        await self._spawn(
+            "node",
+            "-e",
+            _LINT_SERVER_SCRIPT,
+            str(SANDBOX_DAEMON_IDLE_TIMEOUT_SECONDS),
+            workdir=workdir,
+            timeout=timeout,
+        )
+
+    async def lint(self, paths: List[str]) -> LintResult:
+        event = await self._request({"op": "lint", "files": paths})
+        if event["event"] == "error":
+            raise RuntimeError(f"Failed to lint: {event['message']}")
+        return LintResult(
+            output=event["output"],
+            has_errors=event["error_count"] > 0,
+            mode="incremental",
+        )
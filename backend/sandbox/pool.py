@@ -0,0 +1,279 @@
+import asyncio
+import math
+import traceback
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import modal
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from db.database import get_db
+from db.models import (
+    PreparedSandbox,
+    PreparedSandboxClaim,
+    PreparedSandboxStatus,
+    Stack,
+)
+from db.queries import release_prepared_sandboxes
+from config import (
+    PREPARED_SANDBOX_POOL_MIN,
+    PREPARED_SANDBOX_POOL_MAX,
+    PREPARED_SANDBOX_DEMAND_WINDOW_SECONDS,
+    PREPARED_SANDBOX_MAX_CONCURRENT_PREPARES,
+)
+
+# Extra sandboxes kept per expected claim while the pool refills, absorbs bursts
+_DEMAND_HEADROOM = 2.0
+# Used until a prepare has been timed
+_DEFAULT_PREPARE_SECONDS = 120.0
+# Placeholders older than this belong to a worker that stopped mid prepare
+_STALE_PREPARE_SECONDS = 15 * 60
+# Every worker runs reconcile, whoever holds this advisory lock does the work for that round
+_RECONCILE_LOCK_KEY = 7240519
+
+PrepareFn = Callable[[Stack], Awaitable[Tuple[Any, str]]]
+
+
+@dataclass
+class StackPoolState:
+    target: int = PREPARED_SANDBOX_POOL_MIN
+    ready: int = 0
+    preparing: int = 0
+    hits: int = 0
+    misses: int = 0
+
+
+def _since(seconds: float) -> datetime:
+    return datetime.now(timezone.utc) - timedelta(seconds=seconds)
+
+
+class PreparedSandboxPool:
+    """
+    Keeps the prepared sandboxes of each stack in line with how fast they are claimed.
+
+    A stack's target is the number of claims expected while a new sandbox is being prepared
+    (with headroom), bounded by PREPARED_SANDBOX_POOL_MIN/MAX. Missing sandboxes are prepared
+    in the background under a global concurrency limit, surplus ones are released gradually.
+
+    All state is in the database so it is shared by every worker: prepares in flight are
+    PREPARING placeholder rows and claims are PreparedSandboxClaim rows.
+    """
+
+    def __init__(self):
+        self._tasks: Set[asyncio.Task] = set()
+
+    def _prepare_seconds(self, db: Session) -> float:
+        # Placeholders are marked ready (setting updated_at) when their prepare finishes
+        seconds = (
+            db.query(
+                func.avg(
+                    func.extract(
+                        "epoch", PreparedSandbox.updated_at - PreparedSandbox.created_at
+                    )
+                )
+            )
+            .filter(
+                PreparedSandbox.status == PreparedSandboxStatus.READY,
+                PreparedSandbox.updated_at.isnot(None),
+            )
+            .scalar()
+        )
+        return float(seconds) if seconds else _DEFAULT_PREPARE_SECONDS
+
+    def _target(self, claims_in_window: int, prepare_seconds: float) -> int:
+        rate = claims_in_window / PREPARED_SANDBOX_DEMAND_WINDOW_SECONDS
+        expected = rate * prepare_seconds * _DEMAND_HEADROOM
+        return max(
+            PREPARED_SANDBOX_POOL_MIN,
+            min(PREPARED_SANDBOX_POOL_MAX, math.ceil(expected)),
+        )
+
+    def _snapshot(self, db: Session) -> List[Tuple[Stack, StackPoolState]]:
+        stacks = db.query(Stack).all()
+        ready_cnts = dict(
+            db.query(PreparedSandbox.stack_id, func.count(PreparedSandbox.id))
+            .join(Stack, Stack.id == PreparedSandbox.stack_id)
+            .filter(
+                PreparedSandbox.status == PreparedSandboxStatus.READY,
+                PreparedSandbox.pack_hash == Stack.pack_hash,
+            )
+            .group_by(PreparedSandbox.stack_id)
+            .all()
+        )
+        preparing_cnts = dict(
+            db.query(PreparedSandbox.stack_id, func.count(PreparedSandbox.id))
+            .filter(PreparedSandbox.status == PreparedSandboxStatus.PREPARING)
+            .group_by(PreparedSandbox.stack_id)
+            .all()
+        )
+        claim_cnts: Dict[Tuple[int, bool], int] = {
+            (stack_id, hit): cnt
+            for stack_id, hit, cnt in db.query(
+                PreparedSandboxClaim.stack_id,
+                PreparedSandboxClaim.hit,
+                func.count(PreparedSandboxClaim.id),
+            )
+            .filter(
+                PreparedSandboxClaim.created_at
+                >= _since(PREPARED_SANDBOX_DEMAND_WINDOW_SECONDS)
+            )
+            .group_by(PreparedSandboxClaim.stack_id, PreparedSandboxClaim.hit)
+            .all()
+        }
+        prepare_seconds = self._prepare_seconds(db)
+
+        snapshot = []
+        for stack in stacks:
+            hits = claim_cnts.get((stack.id, True), 0)
+            misses = claim_cnts.get((stack.id, False), 0)
+            state = StackPoolState(
+                target=self._target(hits + misses, prepare_seconds),
+                ready=ready_cnts.get(stack.id, 0),
+                preparing=preparing_cnts.get(stack.id, 0),
+                hits=hits,
+                misses=misses,
+            )
+            snapshot.append((stack, state))
+        return snapshot
+
+    async def reconcile(self, db: Session, prepare: PrepareFn):
+        """Update every stack's target and start/stop preparing sandboxes to match it."""
+        locked = db.execute(
+            select(func.pg_try_advisory_xact_lock(_RECONCILE_LOCK_KEY))
+        ).scalar()
+        if not locked:
+            db.rollback()
+            return
+
+        stale = (
+            db.query(PreparedSandbox)
+            .filter(
+                PreparedSandbox.status == PreparedSandboxStatus.PREPARING,
+                PreparedSandbox.created_at < _since(_STALE_PREPARE_SECONDS),
+            )
+            .delete(synchronize_session=False)
+        )
+        if stale:
+            print(f"Removed {stale} stale prepared sandbox placeholders")
+
+        snapshot = self._snapshot(db)
+        budget = PREPARED_SANDBOX_MAX_CONCURRENT_PREPARES - sum(
+            state.preparing for _, state in snapshot
+        )
+        placeholders: List[PreparedSandbox] = []
+        vol_labels: List[str] = []
+        for stack, state in snapshot:
+            to_add = min(state.target - state.ready - state.preparing, budget)
+            if to_add > 0:
+                print(
+                    f"Preparing {to_add} sandboxes for stack {stack.title} ({stack.id}, target={state.target}, ready={state.ready}, preparing={state.preparing})"
+                )
+                budget -= to_add
+                for _ in range(to_add):
+                    placeholder = PreparedSandbox(
+                        stack_id=stack.id,
+                        pack_hash=stack.pack_hash,
+                        status=PreparedSandboxStatus.PREPARING,
+                    )
+                    db.add(placeholder)
+                    placeholders.append(placeholder)
+            elif state.ready > state.target and state.preparing == 0:
+                # One at a time so a short lull doesn't drain the pool
+                vol_labels.extend(release_prepared_sandboxes(db, stack.id, 1))
+        db.flush()
+        placeholder_ids = [placeholder.id for placeholder in placeholders]
+        # Releases the lock, the placeholders now count as preparing for every worker
+        db.commit()
+
+        for placeholder_id in placeholder_ids:
+            task = asyncio.create_task(self._prepare(placeholder_id, prepare))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        for vol_label in vol_labels:
+            print(f"Releasing idle prepared sandbox (vol={vol_label})")
+            await self._delete_volume(vol_label)
+
+    async def _prepare(self, placeholder_id: int, prepare: PrepareFn):
+        db = next(get_db())
+        vol_id = None
+        try:
+            stack = (
+                db.query(Stack)
+                .join(PreparedSandbox, PreparedSandbox.stack_id == Stack.id)
+                .filter(PreparedSandbox.id == placeholder_id)
+                .first()
+            )
+            db.commit()
+            if not stack:
+                return
+            sb, vol_id = await prepare(stack)
+            updated = (
+                db.query(PreparedSandbox)
+                .filter(
+                    PreparedSandbox.id == placeholder_id,
+                    PreparedSandbox.status == PreparedSandboxStatus.PREPARING,
+                )
+                .update(
+                    {
+                        "status": PreparedSandboxStatus.READY,
+                        "modal_sandbox_id": sb.object_id,
+                        "modal_volume_label": vol_id,
+                    },
+                    synchronize_session=False,
+                )
+            )
+            db.commit()
+            if updated:
+                return
+            print(
+                f"Prepared sandbox placeholder {placeholder_id} was removed while preparing"
+            )
+        except Exception as e:
+            db.rollback()
+            print(
+                f"Failed to prepare sandbox {placeholder_id}: {e}\n{traceback.format_exc()}"
+            )
+            try:
+                db.query(PreparedSandbox).filter(
+                    PreparedSandbox.id == placeholder_id,
+                    PreparedSandbox.status == PreparedSandboxStatus.PREPARING,
+                ).delete(synchronize_session=False)
+                db.commit()
+            except Exception as delete_err:
+                db.rollback()
+                print(
+                    f"Failed to remove prepared sandbox placeholder {placeholder_id}: {delete_err}"
+                )
+        finally:
+            db.close()
+        if vol_id:
+            await self._delete_volume(vol_id)
+
+    async def _delete_volume(self, vol_label: str):
+        try:
+            await modal.Volume.delete.aio(name=vol_label)
+        except Exception as e:
+            print(f"Failed to delete volume {vol_label}: {e}")
+
+    def stats(self, db: Session) -> Dict[int, Dict[str, Optional[float]]]:
+        """Pool metrics by stack id, hits and misses are claims within the demand window."""
+        return {
+            stack.id: {
+                "target": state.target,
+                "ready": state.ready,
+                "preparing": state.preparing,
+                "hits": state.hits,
+                "misses": state.misses,
+                "hit_rate": (
+                    state.hits / (state.hits + state.misses)
+                    if state.hits + state.misses
+                    else None
+                ),
+            }
+            for stack, state in self._snapshot(db)
+        }
+
+
+prepared_sandbox_pool = PreparedSandboxPool()
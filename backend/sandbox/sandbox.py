@@ -1,28 +1,74 @@
 import modal
-import aiohttp
 import asyncio
-import base64
 import datetime
 import uuid
 import io
-from typing import List, Optional, Tuple, AsyncGenerator, Union
-from modal.volume import FileEntryType
+import tarfile
+from typing import Callable, Dict, List, Optional, Tuple, AsyncGenerator, Union
 from asyncio import Lock
-from functools import lru_cache
+from sqlalchemy import update
 
 from db.database import get_db
-from db.models import Project, PreparedSandbox, Stack
-from config import MODAL_APP_NAME
+from db.models import Project, Stack
+from db.queries import claim_prepared_sandbox, record_prepared_sandbox_claim
+from sandbox.file_index import get_project_file_index
+from sandbox.file_cache import file_cache
+from sandbox.daemon import SandboxDaemon, SandboxDaemonError
+from sandbox.dev_logs import DevServerLogs
+from sandbox.health import is_url_up, wait_until_up
+from sandbox.lint import (
+    ESLINT_CONFIG_PATH,
+    LintServer,
+    LintResult,
+    is_lint_config,
+    is_lintable,
+)
+from config import (
+    MODAL_APP_NAME,
+    SANDBOX_DAEMON_ENABLED,
+    LINT_SERVER_ENABLED,
+    SANDBOX_BOOT_DEADLINE_SECONDS,
+)
 
 app = modal.App.lookup(MODAL_APP_NAME, create_if_missing=True)
 
 
-IGNORE_PATHS = ["node_modules", ".git", ".next", "build", "git.log", "tmp"]
+# In-flight get_or_create calls by (project_id, create_if_missing)
+_get_or_create_tasks: Dict[Tuple[int, bool], asyncio.Task] = {}
 
 
-@lru_cache()
-def _get_project_lock(project_id: int) -> Lock:
-    return Lock()
+_COMMIT_INFO_MARKER = "__SPARK_STACK_COMMIT_INFO__"
+
+# Modal buffers at most 2MiB of stdin between drains
+_STDIN_CHUNK_SIZE = 1024 * 1024
+
+# Reads a tar of files from stdin, stages each next to its target and then renames them all into place
+_WRITE_FILES_SCRIPT = """
+import io
+import os
+import sys
+import tarfile
+import tempfile
+
+staged = []
+try:
+    with tarfile.open(fileobj=io.BytesIO(sys.stdin.buffer.read()), mode="r:") as tar:
+        for member in tar.getmembers():
+            path = os.path.abspath(member.name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".spark-write-")
+            staged.append((tmp_path, path))
+            with os.fdopen(fd, "wb") as f:
+                f.write(tar.extractfile(member).read())
+            os.chmod(tmp_path, os.stat(path).st_mode if os.path.exists(path) else 0o644)
+except Exception:
+    for tmp_path, _ in staged:
+        os.remove(tmp_path)
+    raise
+
+for tmp_path, path in staged:
+    os.replace(tmp_path, path)
+"""
 
 
 class SandboxNotReadyException(Exception):
@@ -33,46 +79,6 @@ def _unique_id():
     return str(uuid.uuid4())
 
 
-async def _is_url_up(url: str) -> bool:
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                return response.status < 500
-    except Exception:
-        return False
-
-
-async def _vol_to_paths(vol: modal.Volume):
-    paths = []
-    entries = await vol.listdir.aio("/", recursive=False)
-
-    def _ends_with_ignore_path(path: str):
-        path_parts = path.split("/")
-        return any(
-            part == ignore_path for ignore_path in IGNORE_PATHS for part in path_parts
-        )
-
-    async def _recurse(path: str):
-        entries = await vol.listdir.aio(path, recursive=False)
-        for entry in entries:
-            if _ends_with_ignore_path(entry.path):
-                continue
-            if entry.type == FileEntryType.DIRECTORY:
-                await _recurse(entry.path)
-            else:
-                paths.append(entry.path)
-
-    for entry in entries:
-        if _ends_with_ignore_path(entry.path):
-            continue
-        if entry.type == FileEntryType.DIRECTORY:
-            await _recurse(entry.path)
-        else:
-            paths.append(entry.path)
-
-    return paths
-
-
 def _strip_app_prefix(path: str) -> str:
     if path.startswith("/app/"):
         return path[len("/app/") :]
@@ -85,33 +91,184 @@ class DevSandbox:
         self.sb = sb
         self.vol = vol
         self.ready = False
+        self.file_index = get_project_file_index(project_id)
+        self._daemon: Optional[SandboxDaemon] = None
+        self._daemon_lock = Lock()
+        self._daemon_failed_at: Optional[datetime.datetime] = None
+        self._lint_server: Optional[LintServer] = None
+        self._lint_server_lock = Lock()
+        self._lint_server_failed_at: Optional[datetime.datetime] = None
+        self.logs = DevServerLogs()
 
     async def is_up(self):
         tunnels = await self.sb.tunnels.aio()
         tunnel_url = tunnels[3000].url
-        return await _is_url_up(tunnel_url)
+        return await is_url_up(tunnel_url)
+
+    def start_log_capture(self):
+        self.logs.start([self.sb.stdout, self.sb.stderr])
 
     async def wait_for_up(self):
-        while True:
-            if await self.is_up():
-                break
-            await asyncio.sleep(1)
+        self.start_log_capture()
+        tunnels = await self.sb.tunnels.aio()
+        # Probes back off while booting, and go again as soon as the dev server reports it's ready
+        if not await wait_until_up(
+            tunnels[3000].url,
+            deadline_seconds=SANDBOX_BOOT_DEADLINE_SECONDS,
+            wake=self.logs.ready,
+        ):
+            raise SandboxNotReadyException(
+                f"Sandbox not up after {SANDBOX_BOOT_DEADLINE_SECONDS}s (project={self.project_id})"
+            )
         self.ready = True
+        # Start the helpers now rather than on the first command of a turn
+        asyncio.create_task(self._warm_helpers())
+
+    async def _warm_helpers(self):
+        await self._get_daemon()
+        if await self.has_file(ESLINT_CONFIG_PATH):
+            await self._get_lint_server("/app/frontend")
+
+    async def _get_daemon(self) -> Optional[SandboxDaemon]:
+        """The sandbox's command daemon, None if it's unavailable (use sb.exec instead)."""
+        if not SANDBOX_DAEMON_ENABLED:
+            return None
+        async with self._daemon_lock:
+            if self._daemon is not None and self._daemon.alive:
+                return self._daemon
+            if self._daemon_failed_at and (
+                datetime.datetime.now() - self._daemon_failed_at
+            ) < datetime.timedelta(minutes=1):
+                return None
+            daemon = SandboxDaemon(self.sb)
+            try:
+                await daemon.start()
+            except Exception as e:
+                print(f"Error starting sandbox daemon (project={self.project_id}): {e}")
+                self._daemon_failed_at = datetime.datetime.now()
+                return None
+            self._daemon = daemon
+            self._daemon_failed_at = None
+            return daemon
+
+    async def _get_lint_server(self, workdir: str) -> Optional[LintServer]:
+        """The warm lint server for `workdir`, None if it's unavailable."""
+        if not LINT_SERVER_ENABLED:
+            return None
+        async with self._lint_server_lock:
+            if self._lint_server is not None and self._lint_server.alive:
+                return self._lint_server
+            if self._lint_server_failed_at and (
+                datetime.datetime.now() - self._lint_server_failed_at
+            ) < datetime.timedelta(minutes=1):
+                return None
+            server = LintServer(self.sb)
+            try:
+                await server.start(workdir)
+            except Exception as e:
+                print(f"Error starting lint server (project={self.project_id}): {e}")
+                self._lint_server_failed_at = datetime.datetime.now()
+                return None
+            self._lint_server = server
+            self._lint_server_failed_at = None
+            return server
+
+    async def lint(
+        self, paths: List[str], workdir: str = "/app/frontend"
+    ) -> LintResult:
+        """Lint just the changed `paths`, running the project's full lint if lint configs changed."""
+        paths = [path if path.startswith("/") else "/app/" + path for path in paths]
+        if any(is_lint_config(path) for path in paths):
+            # The warm server has the old config loaded
+            async with self._lint_server_lock:
+                if self._lint_server is not None:
+                    await self._lint_server.close()
+                    self._lint_server = None
+            return await self._full_lint(workdir)
+
+        lintable = [
+            path
+            for path in paths
+            if path.startswith(workdir.rstrip("/") + "/") and is_lintable(path)
+        ]
+        if not lintable:
+            return LintResult(output="", has_errors=False, mode="skipped")
+        if server := await self._get_lint_server(workdir):
+            try:
+                return await server.lint(lintable)
+            except Exception as e:
+                print(f"Incremental lint failed, falling back to full lint: {e}")
+        return await self._full_lint(workdir)
 
-    async def get_file_paths(self) -> List[str]:
-        paths = await _vol_to_paths(self.vol)
-        return sorted(["/app/" + path for path in paths])
+    async def _full_lint(self, workdir: str) -> LintResult:
+        # Linting doesn't write files, so the caches stay valid
+        output = await self._exec_shell("npm run lint", workdir=workdir)
+        return LintResult(output=output, has_errors="Error:" in output, mode="full")
 
-    async def run_command(self, command: str, workdir: Optional[str] = None) -> str:
+    async def get_file_paths(self) -> List[str]:
+        paths = await self.file_index.get_paths(self.vol)
+        return ["/app/" + path for path in paths]
+
+    async def _exec_shell(
+        self,
+        command: str,
+        workdir: Optional[str] = None,
+        timeout: Optional[float] = None,
+        on_output: Optional[Callable[[str], None]] = None,
+    ) -> str:
+        if daemon := await self._get_daemon():
+            try:
+                result = await daemon.run(
+                    command,
+                    workdir=workdir or "/app",
+                    timeout=timeout,
+                    on_output=on_output,
+                )
+            except SandboxDaemonError as e:
+                if e.sent:
+                    # The command may have run (partly), running it again could repeat it
+                    return f"Error: {e}, the command may or may not have completed"
+                print(f"Sandbox daemon unavailable, falling back to exec: {e}")
+            except Exception as e:
+                return f"Error: {e}"
+            else:
+                if result.timed_out:
+                    return result.output + f"\n[Command timed out after {timeout}s]"
+                return result.output
         try:
             proc = await self.sb.exec.aio(
-                "sh", "-c", command, workdir=workdir or "/app"
+                "sh",
+                "-c",
+                command,
+                workdir=workdir or "/app",
+                timeout=int(timeout) if timeout else None,
             )
             await proc.wait.aio()
-            return (await proc.stdout.read.aio()) + (await proc.stderr.read.aio())
+            output = (await proc.stdout.read.aio()) + (await proc.stderr.read.aio())
+            if on_output and output:
+                on_output(output)
+            return output
         except Exception as e:
             return f"Error: {e}"
 
+    async def run_command(
+        self,
+        command: str,
+        workdir: Optional[str] = None,
+        timeout: Optional[float] = None,
+        on_output: Optional[Callable[[str], None]] = None,
+    ) -> str:
+        """Run a shell command, `on_output` is called with output as it's produced."""
+        try:
+            return await self._exec_shell(
+                command, workdir=workdir, timeout=timeout, on_output=on_output
+            )
+        finally:
+            # Arbitrary commands may have changed files behind the read cache and the
+            # file index, which can't tell which ones without walking the volume
+            file_cache.mark_dirty(self.project_id)
+            self.file_index.invalidate()
+
     async def run_command_stream(
         self, command: str, workdir: Optional[str] = None
     ) -> AsyncGenerator[str, None]:
@@ -120,33 +277,48 @@ class DevSandbox:
             yield chunk
 
     async def commit_changes(self, commit_message: str):
-        await self.run_command(f"git add -A && git commit -m {repr(commit_message)}")
-        await self.run_command(
-            'git log --pretty="%h|%s|%aN|%aE|%aD" -n 50 > /app/git.log'
+        # Committing leaves the working tree as is, only git.log needs to be re-read
+        output = await self._exec_shell(
+            f"git add -A && git commit -m {repr(commit_message)}; "
+            'git log --pretty="%h|%s|%aN|%aE|%aD" -n 50 > /app/git.log; '
+            f"echo {_COMMIT_INFO_MARKER}; git log -1 --pretty='%H%n%P'; "
+            "git diff-tree -r --root --no-commit-id --name-status HEAD"
         )
+        file_cache.invalidate(self.project_id, ["git.log"])
+        self._record_commit_in_index(output)
+
+    def _record_commit_in_index(self, commit_output: str):
+        if _COMMIT_INFO_MARKER not in commit_output:
+            self.file_index.invalidate()
+            return
+        lines = commit_output.split(_COMMIT_INFO_MARKER, 1)[1].strip().split("\n")
+        if len(lines) < 2:
+            self.file_index.invalidate()
+            return
+        head, parents = lines[0].strip(), lines[1].split()
+        changes = []
+        for line in lines[2:]:
+            parts = line.split("\t")
+            if len(parts) == 2:
+                changes.append((parts[0], parts[1]))
+        self.file_index.record_commit(head, parents, changes)
 
     async def read_file_contents(
         self, path: str, does_not_exist_ok: bool = False
     ) -> str:
         path = _strip_app_prefix(path)
-        content = []
-        try:
-            async for chunk in self.vol.read_file.aio(path):
-                content.append(chunk.decode("utf-8"))
-        except FileNotFoundError as e:
+        content = await file_cache.read(self.project_id, self.vol, path)
+        if content is None:
             if does_not_exist_ok:
                 return ""
-            raise e
-        return "".join(content)
+            raise FileNotFoundError(path)
+        return content.decode("utf-8")
 
     async def has_file(self, path: str):
-        try:
-            # Attempt to get first chunk of the file
-            async for _ in self.vol.read_file.aio(_strip_app_prefix(path)):
-                return True  # If we can read any chunk, the file exists
-            return True  # Empty file case
-        except FileNotFoundError:
-            return False
+        content = await file_cache.read(
+            self.project_id, self.vol, _strip_app_prefix(path)
+        )
+        return content is not None
 
     async def stream_file_contents(
         self, path: str, binary_mode: bool = False
@@ -176,42 +348,60 @@ class DevSandbox:
     ) -> Optional[bytes]:
         if vol_id := project.modal_volume_label:
             vol = modal.Volume.from_name(name=vol_id)
-            try:
-                data = b""
-                async for chunk in vol.read_file.aio(_strip_app_prefix(path)):
-                    data += chunk
-            except FileNotFoundError:
-                return None
-            else:
-                return data
+            return await file_cache.read(project.id, vol, _strip_app_prefix(path))
         return None
 
-    async def write_file(self, path: str, content: str):
-        files = [(path, content)]
-        files_data = []
-        for path, content in files:
-            encoded_content = base64.b64encode(content.encode("utf-8")).decode("utf-8")
-            files_data.append((path, encoded_content))
-
-        # Note: This hacky approach helps with auto-reload which doesn't work with modal.Volume.batch_upload
-        python_cmd = f"""
-import os
-import base64
-
-files = {str(files_data)}
+    async def write_files(self, files: List[Tuple[str, str]]):
+        """Write several files with a single exec, swapping them all in once every file is staged."""
+        if not files:
+            return
 
-for path, base64_content in files:
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, 'w') as f:
-        f.write(base64.b64decode(base64_content).decode('utf-8'))
-"""
+        if daemon := await self._get_daemon():
+            try:
+                await daemon.write_files(files)
+            except SandboxDaemonError as e:
+                print(f"Sandbox daemon unavailable, falling back to exec: {e}")
+            else:
+                self._mark_files_written(files)
+                return
+
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode="w") as tar:
+            for path, content in files:
+                data = content.encode("utf-8")
+                info = tarfile.TarInfo(name=path)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+
+        # Note: Writing from inside the sandbox helps with auto-reload which doesn't work with modal.Volume.batch_upload
         proc = await self.sb.exec.aio(
             "python3",
             "-c",
-            python_cmd,
+            _WRITE_FILES_SCRIPT,
             workdir="/app",
         )
-        await proc.wait.aio()
+        data = archive.getvalue()
+        for i in range(0, len(data), _STDIN_CHUNK_SIZE):
+            proc.stdin.write(data[i : i + _STDIN_CHUNK_SIZE])
+            await proc.stdin.drain.aio()
+        proc.stdin.write_eof()
+        await proc.stdin.drain.aio()
+        return_code = await proc.wait.aio()
+        if return_code != 0:
+            raise RuntimeError(
+                f"Failed to write files (code={return_code}): {await proc.stderr.read.aio()}"
+            )
+        self._mark_files_written(files)
+
+    def _mark_files_written(self, files: List[Tuple[str, str]]):
+        self.file_index.mark_written([_strip_app_prefix(path) for path, _ in files])
+        for path, content in files:
+            file_cache.put(
+                self.project_id, _strip_app_prefix(path), content.encode("utf-8")
+            )
+
+    async def write_file(self, path: str, content: str):
+        await self.write_files([(path, content)])
 
     @classmethod
     async def write_project_file(
@@ -220,9 +410,12 @@ for path, base64_content in files:
         if vol_id := project.modal_volume_label:
             vol = modal.Volume.from_name(name=vol_id)
             path = _strip_app_prefix(path)
+            get_project_file_index(project.id).mark_written([path])
+            file_cache.invalidate(project.id, [path])
             with io.BytesIO(content.encode("utf-8")) as f:
                 async with vol.batch_upload(force=True) as batch:
                     batch.put_file(f, path)
+            file_cache.put(project.id, path, content.encode("utf-8"))
 
     @classmethod
     async def destroy_project_resources(cls, project: Project):
@@ -242,39 +435,57 @@ for path, base64_content in files:
     async def get_or_create(
         cls, project_id: int, create_if_missing: bool = True
     ) -> "DevSandbox":
-        lock = _get_project_lock(project_id)
+        # Concurrent callers for the same project share a single attempt
+        key = (project_id, create_if_missing)
+        task = _get_or_create_tasks.get(key)
+        if task is None:
+            task = asyncio.create_task(
+                cls._get_or_create(project_id, create_if_missing)
+            )
+            _get_or_create_tasks[key] = task
+            task.add_done_callback(lambda _: _get_or_create_tasks.pop(key, None))
+        return await asyncio.shield(task)
+
+    @classmethod
+    async def _get_or_create(
+        cls, project_id: int, create_if_missing: bool
+    ) -> "DevSandbox":
+        db = next(get_db())
         try:
-            await lock.acquire()
-            db = next(get_db())
             project = db.query(Project).filter(Project.id == project_id).first()
-            stack = db.query(Stack).filter(Stack.id == project.stack_id).first()
+            stack = (
+                db.query(Stack).filter(Stack.id == project.stack_id).first()
+                if project
+                else None
+            )
             if not project or not stack:
                 raise SandboxNotReadyException(
                     f"Project or stack not found (project={project_id})"
                 )
 
             if not project.modal_volume_label:
-                existing_psb = (
-                    db.query(PreparedSandbox)
-                    .filter(PreparedSandbox.stack_id == stack.id)
-                    .first()
-                )
-                if not existing_psb:
+                vol_label = claim_prepared_sandbox(db, stack.id, project_id)
+                db.refresh(project)
+                if vol_label or not project.modal_volume_label:
+                    record_prepared_sandbox_claim(
+                        db, project_id, stack.id, hit=bool(vol_label)
+                    )
+                if not project.modal_volume_label:
                     raise SandboxNotReadyException(
                         f"No prepared sandbox found for stack (stack={stack.id}, project={project_id})"
                     )
-
-                project.modal_volume_label = existing_psb.modal_volume_label
-                db.delete(existing_psb)
-                db.commit()
-                print(
-                    f"Using existing prepared sandbox for project (psb={existing_psb.id}, vol={project.modal_volume_label}) -> (project={project_id})"
-                )
+                if vol_label:
+                    print(
+                        f"Using existing prepared sandbox for project (vol={vol_label}) -> (project={project_id})"
+                    )
+            # Don't keep a transaction open across the network calls below
+            db.commit()
 
             vol = modal.Volume.from_name(name=project.modal_volume_label)
 
-            if project.modal_sandbox_id:
-                sb = await modal.Sandbox.from_id.aio(project.modal_sandbox_id)
+            prev_sandbox_id = project.modal_sandbox_id
+            if prev_sandbox_id:
+                sb = await modal.Sandbox.from_id.aio(prev_sandbox_id)
                 poll_code = await sb.poll.aio()
                 return_code = sb.returncode
                 sb_is_up = ((poll_code is None) or (return_code is None)) or (
@@ -288,7 +499,7 @@ for path, base64_content in files:
                         f"Sandbox is not ready for project (project={project_id})"
                     )
                 print(
-                    f"Booting new sandbox for project (project={project_id}, prev_sandbox={project.modal_sandbox_id})",
+                    f"Booting new sandbox for project (project={project_id}, prev_sandbox={prev_sandbox_id})",
                 )
 
                 expires_in = 60 * 60
@@ -305,25 +516,47 @@ for path, base64_content in files:
                     cpu=0.125,
                     memory=1024 * 2,
                 )
-                project.modal_sandbox_id = sb.object_id
-                project.modal_sandbox_last_used_at = datetime.datetime.now()
-                project.modal_sandbox_expires_at = (
-                    datetime.datetime.now() + datetime.timedelta(seconds=expires_in)
-                )
+                # Only take over the project if no one else replaced its sandbox meanwhile
+                claimed = db.execute(
+                    update(Project)
+                    .where(
+                        Project.id == project_id,
+                        (
+                            Project.modal_sandbox_id == prev_sandbox_id
+                            if prev_sandbox_id
+                            else Project.modal_sandbox_id.is_(None)
+                        ),
+                    )
+                    .values(
+                        modal_sandbox_id=sb.object_id,
+                        modal_sandbox_last_used_at=datetime.datetime.now(),
+                        modal_sandbox_expires_at=datetime.datetime.now()
+                        + datetime.timedelta(seconds=expires_in),
+                    )
+                    .execution_options(synchronize_session=False)
+                ).rowcount
                 db.commit()
-                await sb.set_tags.aio(
-                    {"project_id": str(project_id), "app": "prompt-stack"}
-                )
-                print(
-                    f"Booted new sandbox for project (sb={sb.object_id}, vol={project.modal_volume_label}, project={project_id})"
-                )
+                if claimed == 0:
+                    print(
+                        f"Another worker booted a sandbox for project first, using theirs (project={project_id})"
+                    )
+                    await sb.terminate.aio()
+                    db.refresh(project)
+                    db.commit()
+                    sb = await modal.Sandbox.from_id.aio(project.modal_sandbox_id)
+                else:
+                    await sb.set_tags.aio(
+                        {"project_id": str(project_id), "app": "prompt-stack"}
+                    )
+                    print(
+                        f"Booted new sandbox for project (sb={sb.object_id}, vol={project.modal_volume_label}, project={project_id})"
+                    )
             else:
                 print("Using existing sandbox for project", project.id)
-                sb = await modal.Sandbox.from_id.aio(project.modal_sandbox_id)
 
             return cls(project_id, sb, vol)
         finally:
-            lock.release()
+            db.close()
 
     @classmethod
     async def prepare_sandbox(cls, stack: Stack) -> Tuple["DevSandbox", str]:
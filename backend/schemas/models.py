@@ -146,6 +146,16 @@ class StackResponse(BaseModel):
         from_attributes = True
 
 
+class PreparedSandboxPoolStats(BaseModel):
+    stack_id: int
+    target: int
+    ready: int
+    preparing: int
+    hits: int
+    misses: int
+    hit_rate: Optional[float]
+
+
 class TeamInviteResponse(BaseModel):
     invite_link: str
 
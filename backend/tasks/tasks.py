@@ -5,9 +5,10 @@ import functools
 import modal
 
 from routers.project_socket import project_managers
-from db.models import Project, PreparedSandbox, Stack
+from db.models import Project, PreparedSandbox, PreparedSandboxStatus, Stack
 from sandbox.sandbox import DevSandbox
-from config import TARGET_PREPARED_SANDBOXES_PER_STACK, PROJECT_RESOURCE_TIMEOUT_SECONDS
+from sandbox.pool import prepared_sandbox_pool
+from config import PROJECT_RESOURCE_TIMEOUT_SECONDS
 
 def task_handler():
     def decorator(func):
@@ -39,36 +40,15 @@ async def cleanup_inactive_project_managers():
 @task_handler()
 async def maintain_prepared_sandboxes(db: Session):
     try:
-        stacks = db.query(Stack).all()
-        for stack in stacks:
-            psboxes = db.query(PreparedSandbox).filter(
-                PreparedSandbox.stack_id == stack.id
-            ).all()
-            psboxes_to_add = max(0, TARGET_PREPARED_SANDBOXES_PER_STACK - len(psboxes))
-
-            if psboxes_to_add > 0:
-                print(
-                    f"Creating {psboxes_to_add} prepared sandboxes for stack {stack.title} ({stack.id})"
-                )
-                for _ in range(psboxes_to_add):
-                    try:
-                        sb, vol_id = await DevSandbox.prepare_sandbox(stack)
-                        psbox = PreparedSandbox(
-                            stack_id=stack.id,
-                            modal_sandbox_id=sb.object_id,
-                            modal_volume_label=vol_id,
-                            pack_hash=stack.pack_hash,
-                        )
-                        db.add(psbox)
-                        db.commit()
-                    except Exception as sandbox_err:
-                        db.rollback()
-                        print(f"Failed to prepare sandbox for stack {stack.id}: {sandbox_err}")
+        await prepared_sandbox_pool.reconcile(db, DevSandbox.prepare_sandbox)
 
+        stacks = db.query(Stack).all()
         latest_stack_hashes = {stack.pack_hash for stack in stacks}
+        # Placeholders are left to finish, they are removed once ready
         psboxes_to_delete = db.query(PreparedSandbox).filter(
+            PreparedSandbox.status == PreparedSandboxStatus.READY,
             (PreparedSandbox.pack_hash.notin_(latest_stack_hashes))
-            | (PreparedSandbox.pack_hash.is_(None))
+            | (PreparedSandbox.pack_hash.is_(None)),
         ).all()
         if psboxes_to_delete:
             print(f"Deleting {len(psboxes_to_delete)} prepared sandboxes with stale hashes")
@@ -0,0 +1,73 @@
+import asyncio
+from types import SimpleNamespace
+
+import agents.agent as agent_module
+from agents.agent import Agent, ChatMessage
+
+_CODE_BLOCK = (
+    "```javascript\n// frontend/app/page.js\nexport default function Page() {}\n```\n"
+)
+
+
+class _RecordingDiffApplier:
+    def __init__(self):
+        self.events = []
+
+    def ingest(self, content: str):
+        self.events.append(("ingest", content))
+
+    async def apply(self):
+        self.events.append(("apply",))
+        return []
+
+
+class _FakeSandbox:
+    def __init__(self):
+        self.logs = SimpleNamespace(event_seq=0, events_since=lambda seq: [])
+
+    async def has_file(self, path: str) -> bool:
+        return False
+
+    async def commit_changes(self, commit_message: str):
+        pass
+
+
+class _ApplyRightAwayProvider:
+    async def chat_complete_with_tools(self, messages, tools, model, temperature=0.0):
+        # Like the real providers, tools run inside the stream right after the content
+        yield {"type": "content", "content": _CODE_BLOCK}
+        apply_changes = next(tool for tool in tools if tool.name == "apply_changes")
+        await apply_changes.func(navigate_to="/", commit_message="Add page")
+
+
+def test_code_blocks_are_ingested_before_a_back_to_back_apply(monkeypatch):
+    appliers = []
+
+    def _make_applier(sandbox):
+        appliers.append(_RecordingDiffApplier())
+        return appliers[-1]
+
+    async def _no_planning(self, messages):
+        return False, "test"
+
+    monkeypatch.setattr(agent_module, "AsyncArtifactDiffApplier", _make_applier)
+    monkeypatch.setattr(
+        agent_module, "get_llm_provider", lambda provider: _ApplyRightAwayProvider()
+    )
+    monkeypatch.setattr(Agent, "_needs_planning", _no_planning)
+
+    agent = Agent(
+        SimpleNamespace(id=1, name="Test", custom_instructions=""),
+        SimpleNamespace(prompt=""),
+        SimpleNamespace(user_type=None),
+    )
+    agent.sandbox = _FakeSandbox()
+
+    async def _consume():
+        async for _ in agent.step([ChatMessage(role="user", content="Add a page")]):
+            # A slow socket, the model stream gets ahead of the consumer
+            await asyncio.sleep(0.01)
+
+    asyncio.run(_consume())
+
+    assert appliers[0].events == [("ingest", _CODE_BLOCK), ("apply",)]
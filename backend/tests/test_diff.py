@@ -0,0 +1,70 @@
+from agents.diff import _apply_local_patch
+
+_ORIGINAL = """import React from "react";
+
+export default function Page() {
+  const items = [];
+  return (
+    <div>
+      <h1>Title</h1>
+      <p>Body</p>
+    </div>
+  );
+}
+"""
+
+
+def test_patches_hunk_between_placeholders():
+    diff = """// ... existing code ...
+    <div>
+      <h1>New title</h1>
+      <p>Body</p>
+// ... existing code ..."""
+    assert _apply_local_patch(_ORIGINAL, diff) == _ORIGINAL.replace(
+        "<h1>Title</h1>", "<h1>New title</h1>"
+    )
+
+
+def test_added_line_duplicating_later_code_is_not_an_anchor():
+    # Anchoring on the added </div> would splice over the <h1> and <p> lines
+    diff = """// ... existing code ...
+    <div>
+      <div>Banner</div>
+    </div>
+// ... existing code ..."""
+    assert _apply_local_patch(_ORIGINAL, diff) is None
+
+
+def test_first_hunk_with_edited_first_line():
+    diff = """import React, { useState } from "react";
+
+export default function Page() {
+// ... existing code ..."""
+    assert _apply_local_patch(_ORIGINAL, diff) == _ORIGINAL.replace(
+        'import React from "react";', 'import React, { useState } from "react";'
+    )
+
+
+def test_imports_added_at_the_top():
+    diff = """import { Button } from "@/components/ui/button";
+import React from "react";
+// ... existing code ..."""
+    assert _apply_local_patch(_ORIGINAL, diff) == (
+        'import { Button } from "@/components/ui/button";\n' + _ORIGINAL
+    )
+
+
+def test_middle_hunk_starting_on_a_new_line_is_left_to_the_llm():
+    diff = """// ... existing code ...
+      <h2>Subtitle</h2>
+      <p>Body</p>
+// ... existing code ..."""
+    assert _apply_local_patch(_ORIGINAL, diff) is None
+
+
+def test_removal_placeholder_is_left_to_the_llm():
+    diff = """// ... existing code ...
+// ... remove the heading ...
+      <p>Body</p>
+// ... existing code ..."""
+    assert _apply_local_patch(_ORIGINAL, diff) is None
@@ -66,6 +66,19 @@ function ChatsTab({ chats, isLoadingChats, router }) {
   );
 }
 
+// Same format the git-log endpoint parses, `hash|message|author|email|date` per line
+function parseGitLog(content) {
+  return {
+    lines: content
+      .split('\n')
+      .filter((line) => line.split('|').length === 5)
+      .map((line) => {
+        const [hash, message, author, email, date] = line.split('|');
+        return { hash, message, author, email, date };
+      }),
+  };
+}
+
 function HistoryTab({ gitLog, isLoadingGitLog, handleRestore }) {
   return (
     <Card className="p-4">
@@ -113,7 +126,7 @@ function HistoryTab({ gitLog, isLoadingGitLog, handleRestore }) {
   );
 }
 
-export function ProjectTab({ project, onSendMessage }) {
+export function ProjectTab({ project, projectGitLog, onSendMessage }) {
   const { team, refreshProjects } = useUser();
   const router = useRouter();
   const [isEditing, setIsEditing] = useState(false);
@@ -158,6 +171,12 @@ export function ProjectTab({ project, onSendMessage }) {
     }
   }, [project, team?.id]);
 
+  // Kept up to date over the project socket, the fetched log is only a fallback
+  const liveGitLog =
+    projectGitLog !== null && projectGitLog !== undefined
+      ? parseGitLog(projectGitLog)
+      : null;
+
   if (!project) {
     return (
       <div className="flex items-center justify-center h-full text-muted-foreground">
@@ -328,8 +347,8 @@ export function ProjectTab({ project, onSendMessage }) {
 
           <TabsContent value="history" className="mt-4">
             <HistoryTab
-              gitLog={gitLog}
-              isLoadingGitLog={isLoadingGitLog}
+              gitLog={liveGitLog || gitLog}
+              isLoadingGitLog={!liveGitLog && isLoadingGitLog}
               handleRestore={handleRestore}
             />
           </TabsContent>
@@ -11,6 +11,7 @@ export function RightPanel({
   projectPreviewUrl,
   projectPreviewHash,
   projectFileTree,
+  projectGitLog,
   project,
   projectPreviewPath,
   setProjectPreviewPath,
@@ -69,7 +70,11 @@ export function RightPanel({
         ) : selectedTab === 'editor' ? (
           <FilesTab projectFileTree={projectFileTree} project={project} />
         ) : (
-          <ProjectTab project={project} onSendMessage={onSendMessage} />
+          <ProjectTab
+            project={project}
+            projectGitLog={projectGitLog}
+            onSendMessage={onSendMessage}
+          />
         )}
       </div>
     </div>
@@ -21,11 +21,13 @@ export default function WorkspacePage({ chatId }) {
   const [projectPreviewUrl, setProjectPreviewUrl] = useState(null);
   const [projectPreviewPath, setProjectPreviewPath] = useState('/');
   const [projectFileTree, setProjectFileTree] = useState([]);
+  const [projectGitLog, setProjectGitLog] = useState(null);
   const [projectStackPackId, setProjectStackPackId] = useState(null);
   const [suggestedFollowUps, setSuggestedFollowUps] = useState([]);
   const [previewHash, setPreviewHash] = useState(1);
   const [status, setStatus] = useState('NEW_CHAT');
   const webSocketRef = useRef(null);
+  const statusSeqRef = useRef(null);
   const { toast } = useToast();
   const [isMobile, setIsMobile] = useState(false);
   const [isSubmitting, setIsSubmitting] = useState(false);
@@ -60,7 +62,7 @@ export default function WorkspacePage({ chatId }) {
           ws.ws.onclose = (e) => {
             setStatus('DISCONNECTED');
             console.log('WebSocket connection closed', e.code, e.reason);
-            if ([1002, 1003].includes(e.code)) {
+            if ([1002, 1003, 1013].includes(e.code)) {
               initializeWebSocket(chatId);
             }
           };
@@ -74,14 +76,19 @@ export default function WorkspacePage({ chatId }) {
           console.log('handleMessage', data);
           if (data.for_type === 'status') {
             handleStatus(data);
+          } else if (data.for_type === 'status_delta') {
+            handleStatusDelta(data);
           } else if (data.for_type === 'chat_update') {
             handleChatUpdate(data);
           } else if (data.for_type === 'chat_chunk') {
             handleChatChunk(data);
+          } else if (data.for_type === 'follow_ups') {
+            setSuggestedFollowUps(data.follow_ups);
           }
         };
 
         const handleStatus = (data) => {
+          statusSeqRef.current = data.seq;
           setStatus(data.sandbox_status);
           if (data.tunnels) {
             setProjectPreviewUrl(data.tunnels[3000]);
@@ -89,6 +96,45 @@ export default function WorkspacePage({ chatId }) {
           if (data.file_paths) {
             setProjectFileTree(data.file_paths);
           }
+          if (data.git_log !== null && data.git_log !== undefined) {
+            setProjectGitLog(data.git_log);
+          }
+        };
+
+        const handleStatusDelta = (data) => {
+          if (statusSeqRef.current === null) {
+            // Waiting on a full status
+            return;
+          }
+          if (data.seq !== statusSeqRef.current + 1) {
+            // Missed an update, ask for the full status again
+            statusSeqRef.current = null;
+            ws.sendMessage({ for_type: 'status_resync' });
+            return;
+          }
+          statusSeqRef.current = data.seq;
+          setStatus(data.sandbox_status);
+          if (data.tunnels) {
+            setProjectPreviewUrl(data.tunnels[3000]);
+          }
+          if (data.added_file_paths.length || data.removed_file_paths.length) {
+            const removed = new Set(data.removed_file_paths);
+            // Sorted like the full status so the tree doesn't reorder on resync
+            setProjectFileTree((prev) =>
+              [
+                ...prev.filter((path) => !removed.has(path)),
+                ...data.added_file_paths,
+              ].sort()
+            );
+          }
+          if (data.git_log !== null && data.git_log !== undefined) {
+            setProjectGitLog(data.git_log);
+          } else if (data.new_git_log_lines.length) {
+            setProjectGitLog((prev) => {
+              const lines = prev ? prev.split('\n') : [];
+              return [...data.new_git_log_lines, ...lines].join('\n');
+            });
+          }
         };
 
         const handleChatUpdate = (data) => {
@@ -251,6 +297,7 @@ export default function WorkspacePage({ chatId }) {
         setMessages([]);
         setProjectPreviewUrl(null);
         setProjectFileTree([]);
+        setProjectGitLog(null);
         setStatus('NEW_CHAT');
       }
     })();
@@ -346,6 +393,7 @@ export default function WorkspacePage({ chatId }) {
                 setProjectPreviewPath={setProjectPreviewPath}
                 projectPreviewHash={previewHash}
                 projectFileTree={projectFileTree}
+                projectGitLog={projectGitLog}
                 project={projects.find((p) => +p.id === +projectId)}
                 chatId={chatId}
                 status={status}
@@ -383,6 +431,7 @@ export default function WorkspacePage({ chatId }) {
               setProjectPreviewPath={setProjectPreviewPath}
               projectPreviewHash={previewHash}
               projectFileTree={projectFileTree}
+              projectGitLog={projectGitLog}
               project={projects.find((p) => +p.id === +projectId)}
               chatId={chatId}
               status={status}